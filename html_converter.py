@@ -1,15 +1,124 @@
 import os
+import sys
 import json
 import re
 import logging
 import datetime
 import time
-from urllib.parse import urlparse
-from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import queue
+import multiprocessing
+import asyncio
+import argparse
+import signal
+import threading
+import uuid
+import random
+import sqlite3
+import hashlib
+import gzip
+import importlib
+import importlib.metadata
+import struct
+import io
+import math
+import glob
+import zlib
+from html.parser import HTMLParser
+import xml.etree.ElementTree as ElementTree
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import mimetypes
+from io import BytesIO
+from collections import deque, OrderedDict
+from dataclasses import dataclass, field
+from urllib.parse import urlparse, urlunparse, urljoin, urldefrag, parse_qs, unquote_plus
+from concurrent.futures import ThreadPoolExecutor, Future
 from dotenv import load_dotenv
+import numpy
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from docling.datamodel.base_models import DocumentStream
 from docling.document_converter import DocumentConverter
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# POSIX only; without it (Windows) urls.txt is read and cleared without locking
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Maximum time a single URL may spend in a worker before the worker is killed
+URL_TIMEOUT = 60
+
+# Maximum time spent waiting on the network while downloading a page
+FETCH_TIMEOUT = 30
+
+USER_AGENT = "Mozilla/5.0 (compatible; docling-beta)"
+
+# Longest wait between two download attempts of the same URL
+RETRY_MAX_DELAY = 30
+
+# Size of the blocks the daemon reads from urls.txt when claiming new lines
+FEED_READ_BYTES = 64 * 1024
+
+# Number of state store updates grouped in one SQLite transaction
+STATE_COMMIT_EVERY = 100
+
+# Converter options that affect the output; part of the conversion cache key, so
+# changing them here invalidates previously cached conversions
+CONVERTER_OPTIONS = {"converter": "DocumentConverter", "options": "default"}
+
+# Query parameters that only track where a visitor came from; removed when URLs
+# are canonicalized (along with every utm_* parameter)
+TRACKING_PARAMS = {"fbclid", "gclid", "gclsrc", "dclid", "msclkid", "yclid", "igshid",
+                   "mc_cid", "mc_eid", "_ga", "_gl", "si"}
+
+# Size of the header written at the start of the .npy vector files; fixed so the
+# header can be rewritten in place as vectors are appended
+NPY_HEADER_SIZE = 128
+
+# Deepest nesting of sitemap indexes followed when reading a sitemap
+MAX_SITEMAP_DEPTH = 3
+
+# Extensions of links the crawler does not follow (assets, media, archives)
+CRAWL_SKIP_EXTENSIONS = {".css", ".js", ".json", ".xml", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp",
+                         ".ico", ".mp3", ".mp4", ".webm", ".avi", ".mov", ".zip", ".gz", ".tar", ".rar",
+                         ".7z", ".exe", ".dmg", ".woff", ".woff2", ".ttf", ".eot"}
+
+# Domain of offline pages (file:// URLs), which have no host: their files are saved
+# under <dir_save>/local/ and their records grouped under this domain
+LOCAL_DOMAIN = "local"
+
+# Largest request body accepted by the job API
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+# Number of jobs the job API keeps in memory; the oldest finished ones are dropped first
+MAX_API_JOBS = 1000
+
+# Takes an exclusive lock on an open file, where file locking is available
+def lock_file(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+def unlock_file(f) -> None:
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
 # Returns a sanitized filename
 def sanitize_filename(name: str) -> str:
     return re.sub(r'[^a-zA-Z0-9\-_\.]', '_', name)
@@ -34,69 +143,2188 @@ def format_time(seconds: float) -> str:
         hours = seconds / 3600
         return f"{hours:.2f} hours"
 
-# Saves the converted files (Markdown and JSON) into the appropriate directory
-def save_files(result, base_dir: str, source_url: str) -> None:
-    parsed = urlparse(source_url)
-    domain = parsed.netloc
-    site_dir = os.path.join(base_dir, domain)
+# Output formats that can be saved, with their file extensions
+OUTPUT_FORMATS = {"markdown": ".md", "json": ".json"}
+
+# What is saved for each page (save_in, save_name, save_options and the JSON settings)
+@dataclass
+class OutputOptions:
+    formats: list = field(default_factory=lambda: ["markdown", "json"])
+    # File name pattern of each format; "name" stands for the page name
+    file_names: dict = field(default_factory=lambda: {"markdown": "name", "json": "name.json"})
+    # "name.pages" names files after the page title, "name.url" after the URL path
+    naming: str = "name.pages"
+    json_markdown: bool = True
+    serializer: str = "json"
+
+# Returns the title of a document from its first title or section heading, for
+# pages whose Markdown is not exported
+def get_document_title(document) -> str:
+    for item in getattr(document, "texts", []):
+        if str(getattr(item, "label", "")) in ("title", "section_header") and item.text.strip():
+            return sanitize_filename(item.text.strip())
+    return "index"
+
+# Exports a converted document to Markdown and to the JSON structure saved alongside it.
+# The structure is taken as a dict directly, so it is serialized only once, when saved.
+# Formats that are not saved are not exported at all.
+def export_document(document, output: OutputOptions | None = None) -> dict:
+    output = output or OutputOptions()
+    md_content = None
+    if "markdown" in output.formats or ("json" in output.formats and output.json_markdown):
+        md_content = document.export_to_markdown()
+    content = None
+    if "json" in output.formats:
+        try:
+            content = document.export_to_dict()
+        except Exception as e:
+            logging.warning(f"Failed to export the document structure. Details: {e}")
+            content = {"error": "Failed to export the document."}
+    return {
+        "title": get_page_title(md_content) if md_content is not None else get_document_title(document),
+        "markdown": md_content,
+        "content": content
+    }
+
+# Returns the name of a page's files: its title, or with "name.url" the last
+# segment of its URL path
+def get_page_name(exported: dict, source_url: str, naming: str) -> str:
+    if naming == "name.url":
+        segment = urlparse(source_url).path.rstrip("/").rsplit("/", 1)[-1]
+        return sanitize_filename(os.path.splitext(segment)[0]) if segment else "index"
+    return exported["title"]
+
+# Returns the file name of a format from its pattern and the page name
+def get_file_name(pattern: str, page_name: str, output_format: str) -> str:
+    file_name = pattern.replace("name", page_name, 1) if "name" in pattern else page_name
+    extension = OUTPUT_FORMATS[output_format]
+    return file_name if file_name.endswith(extension) else f"{file_name}{extension}"
+
+# Writes text to a binary file as UTF-8
+def dump_text(f, text: str) -> None:
+    f.write(text.encode("utf-8"))
+
+# Writes data to a binary file as indented JSON. The standard library encoder streams it
+# into the file chunk by chunk; orjson, when installed and selected, encodes it in one
+# much faster pass.
+def dump_json(f, data: dict, serializer: str = "json") -> None:
+    if serializer == "orjson":
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        return
+    text = io.TextIOWrapper(f, encoding="utf-8")
+    json.dump(data, text, indent=2, ensure_ascii=False)
+    text.flush()
+    text.detach()
+
+# Writes a file atomically: dump(f, *args) writes it to a temporary file that is then
+# renamed over the final path, so readers never see a partly written file
+def write_file_atomic(path: str, dump, *args) -> None:
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        dump(f, *args)
+    os.replace(temp_path, path)
+
+# Write-behind file writer: a dedicated I/O thread takes files from a bounded queue
+# and writes each one (by calling its dump function, so large JSON is encoded
+# straight into the file) to a temporary file that is renamed into place. To make the
+# files durable without one fsync per file, renames are grouped in commits of up to
+# fsync_every files or fsync_interval seconds: the temporary files of a commit are
+# fsynced, renamed, and then their directories are fsynced. fsync_every = 0 renames
+# every file right away without fsync. Each file gets a future that is resolved
+# once its commit is done, or fails with the error that kept it from being written.
+class FileWriter:
+    def __init__(self, queue_size: int, fsync_every: int, fsync_interval: float):
+        self.queue = queue.Queue(queue_size)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.sequence = 0
+        self.thread = threading.Thread(target=self.run, name="file-writer", daemon=True)
+        self.thread.start()
+
+    # Queues a file written by dump(f, *args) and returns its future; blocks only while
+    # the queue is full
+    def write(self, path: str, dump, *args) -> Future:
+        future = Future()
+        self.queue.put((path, dump, args, future))
+        return future
+
+    def run(self) -> None:
+        batch = []
+        deadline = 0.0
+        while True:
+            try:
+                timeout = max(0.0, deadline - time.monotonic()) if batch else None
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item:
+                entry = self.write_temp(*item)
+                if entry is not None:
+                    if not batch:
+                        deadline = time.monotonic() + self.fsync_interval
+                    batch.append(entry)
+            if batch and (item is None or self.fsync_every <= 0 or len(batch) >= self.fsync_every
+                          or time.monotonic() >= deadline):
+                self.commit(batch)
+                batch = []
+            if item is None:
+                return
+
+    def write_temp(self, path: str, dump, args: tuple, future: Future) -> tuple | None:
+        self.sequence += 1
+        temp_path = f"{path}.{self.sequence}.tmp"
+        try:
+            f = open(temp_path, "wb")
+            try:
+                dump(f, *args)
+                f.flush()
+            except Exception:
+                f.close()
+                os.remove(temp_path)
+                raise
+            return f, temp_path, path, future
+        except Exception as e:
+            logging.error(f"Error writing file: {path}. Details: {e}")
+            future.set_exception(e)
+            return None
+
+    def commit(self, batch: list) -> None:
+        directories = set()
+        committed = []
+        for f, temp_path, path, future in batch:
+            try:
+                if self.fsync_every > 0:
+                    os.fsync(f.fileno())
+                f.close()
+                os.replace(temp_path, path)
+                directories.add(os.path.dirname(path) or ".")
+                committed.append(future)
+            except OSError as e:
+                logging.error(f"Error writing file: {path}. Details: {e}")
+                f.close()
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                future.set_exception(e)
+        if self.fsync_every > 0:
+            for directory in directories:
+                try:
+                    fd = os.open(directory, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError as e:
+                    logging.warning(f"Could not fsync directory {directory}: {e}")
+        for future in committed:
+            future.set_result(None)
+
+    # Writes and commits everything queued, then stops the I/O thread
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+
+# Saves the exported files (Markdown and/or JSON) into the appropriate directory and
+# returns their paths by format, with the futures of the files still to be committed.
+# With a writer, the files are handed to its I/O thread; otherwise they are written
+# atomically right away and there are no futures.
+def save_files(exported: dict, base_dir: str, source_url: str, output: OutputOptions | None = None,
+               writer: FileWriter | None = None) -> tuple:
+    output = output or OutputOptions()
+    site_dir = os.path.join(base_dir, get_url_domain(source_url))
+    # The domain comes from the URL, so it must not lead out of base_dir (e.g. "..")
+    base_path = os.path.abspath(base_dir)
+    site_path = os.path.abspath(site_dir)
+    if site_path == base_path or os.path.commonpath([base_path, site_path]) != base_path:
+        raise ValueError(f"Invalid output directory for URL: {source_url}")
     os.makedirs(site_dir, exist_ok=True)
     
-    md_content = result.document.export_to_markdown()
-    page_title = get_page_title(md_content)
+    md_content = exported["markdown"]
+    page_title = exported["title"]
+    page_name = get_page_name(exported, source_url, output.naming)
+    files = {}
+    committed = []
+    write = writer.write if writer is not None else write_file_atomic
     
-    md_file = os.path.join(site_dir, f"{page_title}.md")
-    with open(md_file, "w", encoding="utf-8") as f:
-        f.write(md_content)
+    if "markdown" in output.formats:
+        md_file = os.path.join(site_dir, get_file_name(output.file_names["markdown"], page_name, "markdown"))
+        committed.append(write(md_file, dump_text, md_content))
+        files["markdown"] = md_file
     
-    json_data = {
-        "title": page_title,
+    if "json" in output.formats:
+        json_data = {
+            "title": page_title,
+            "source_url": source_url,
+            "processed_at": datetime.datetime.now().isoformat(),
+            "content": exported["content"]
+        }
+        if output.json_markdown:
+            json_data["markdown"] = md_content
+        json_file = os.path.join(site_dir, get_file_name(output.file_names["json"], page_name, "json"))
+        committed.append(write(json_file, dump_json, json_data, output.serializer))
+        files["json"] = json_file
+    
+    logging.info(f"Files saved in: {site_dir}")
+    return files, committed if writer is not None else []
+
+# Returns the paths of the files saved for a URL (its outputs may also hold the
+# position of its record in a shard)
+def get_output_paths(files: dict) -> list:
+    return [files[key] for key in ("markdown", "json", "shard", "database") if key in files]
+
+# Builds the record of a page written to a shard: the fields of the JSON file, with
+# the Markdown and the document structure present according to save_in
+def build_shard_record(exported: dict, source_url: str, output: OutputOptions) -> dict:
+    record = {
+        "title": exported["title"],
         "source_url": source_url,
-        "processed_at": datetime.datetime.now().isoformat(),
-        "content": None,
-        "markdown": md_content
+        "processed_at": datetime.datetime.now().isoformat()
     }
+    if "markdown" in output.formats:
+        record["markdown"] = exported["markdown"]
+    if "json" in output.formats:
+        record["content"] = exported["content"]
+    return record
+
+# Appends pages as JSON lines to a few large shard files instead of two small files
+# per page: one shard per primary domain ("domain") or for the whole run ("run").
+# A shard is rotated once it reaches max_bytes. With gzip or zstd compression every
+# record is compressed as its own gzip member / zstd frame, so a shard is still a
+# valid .gz/.zst file for the usual tools, and any record can be read back alone.
+# Each shard has an index (<shard>.idx, JSON lines of url, offset and length) with
+# the position of every record.
+class ShardWriter:
+    def __init__(self, directory: str, shard_by: str, max_bytes: int, compression: str, output: OutputOptions):
+        self.directory = directory
+        self.shard_by = shard_by
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.output = output
+        self.run_id = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.extension = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}.get(compression, ".jsonl")
+        self.shards = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def encode(self, record: dict) -> bytes:
+        if self.output.serializer == "orjson":
+            data = orjson.dumps(record) + b"\n"
+        else:
+            data = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        if self.compression == "gzip":
+            return gzip.compress(data, compresslevel=6)
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor().compress(data)
+        return data
+
+    # Syncs a shard and its index to disk and closes them
+    def close_shard(self, shard: dict) -> None:
+        for f in (shard["file"], shard["index"]):
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+    # Opens the next shard of a key, closing the current one
+    def rotate(self, key: str) -> dict:
+        shard = self.shards.get(key)
+        if shard is not None:
+            self.close_shard(shard)
+        sequence = shard["sequence"] + 1 if shard is not None else 0
+        path = os.path.join(self.directory, f"{sanitize_filename(key)}-{self.run_id}-{sequence:05d}{self.extension}")
+        self.shards[key] = {
+            "path": path,
+            "file": open(path, "ab"),
+            "index": open(f"{path}.idx", "a", encoding="utf-8"),
+            "size": os.path.getsize(path),
+            "sequence": sequence
+        }
+        return self.shards[key]
+
+    # Appends a page to its shard and returns where it was written. Both files are
+    # flushed first, so the record can be read back as soon as this returns.
+    def write(self, exported: dict, source_url: str) -> dict:
+        data = self.encode(build_shard_record(exported, source_url, self.output))
+        key = get_primary_domain(get_url_domain(source_url)) if self.shard_by == "domain" else "run"
+        with self.lock:
+            shard = self.shards.get(key)
+            if shard is None or (shard["size"] > 0 and shard["size"] + len(data) > self.max_bytes):
+                shard = self.rotate(key)
+            offset = shard["size"]
+            shard["file"].write(data)
+            shard["size"] += len(data)
+            shard["index"].write(json.dumps({"url": source_url, "offset": offset, "length": len(data)}) + "\n")
+            shard["file"].flush()
+            shard["index"].flush()
+        return {"shard": shard["path"], "offset": offset, "length": len(data)}
+
+    def close(self) -> None:
+        with self.lock:
+            for shard in self.shards.values():
+                self.close_shard(shard)
+            self.shards = {}
+
+# Stores pages in a SQLite database instead of files: one row per URL with its
+# primary domain, title, Markdown, document structure (JSON), timings and hashes,
+# plus an FTS5 full-text index over the title and Markdown, kept in sync by
+# triggers. Rows are buffered and inserted batch_size at a time, one transaction
+# per batch, or flush_interval seconds after the first row of a batch was buffered.
+# Each row gets a future resolved once its transaction is committed. Written from
+# the write threads, so every access holds the lock.
+class OutputDatabase:
+    def __init__(self, path: str, batch_size: int, flush_interval: float = 1.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.timer = None
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                domain TEXT,
+                title TEXT,
+                markdown TEXT,
+                content TEXT,
+                processing_time REAL,
+                processed_at TEXT,
+                content_hash TEXT,
+                markdown_hash TEXT
+            );
+            CREATE INDEX IF NOT EXISTS pages_domain ON pages (domain);
+            CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+                title, markdown, content='pages', content_rowid='rowid');
+            CREATE TRIGGER IF NOT EXISTS pages_ai AFTER INSERT ON pages BEGIN
+                INSERT INTO pages_fts (rowid, title, markdown) VALUES (new.rowid, new.title, new.markdown);
+            END;
+            CREATE TRIGGER IF NOT EXISTS pages_ad AFTER DELETE ON pages BEGIN
+                INSERT INTO pages_fts (pages_fts, rowid, title, markdown)
+                VALUES ('delete', old.rowid, old.title, old.markdown);
+            END;
+            CREATE TRIGGER IF NOT EXISTS pages_au AFTER UPDATE ON pages BEGIN
+                INSERT INTO pages_fts (pages_fts, rowid, title, markdown)
+                VALUES ('delete', old.rowid, old.title, old.markdown);
+                INSERT INTO pages_fts (rowid, title, markdown) VALUES (new.rowid, new.title, new.markdown);
+            END;
+        """)
+        self.conn.commit()
+
+    # Queues a page for the next batch; returns where it is stored and its future
+    def write(self, exported: dict, source_url: str, content_hash: str | None, processing_time: float) -> tuple:
+        markdown = exported["markdown"]
+        row = (
+            source_url,
+            get_primary_domain(get_url_domain(source_url)),
+            exported["title"],
+            markdown,
+            json.dumps(exported["content"], ensure_ascii=False) if exported["content"] is not None else None,
+            round(processing_time, 2),
+            datetime.datetime.now().isoformat(),
+            content_hash,
+            hashlib.sha256(markdown.encode("utf-8")).hexdigest() if markdown is not None else None
+        )
+        future = Future()
+        with self.lock:
+            self.pending.append((row, future))
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        return {"database": self.path}, future
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            self._insert([row for row, _ in batch])
+        except sqlite3.Error as e:
+            logging.error(f"Error writing {len(batch)} page(s) to {self.path}. Details: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for _, future in batch:
+            future.set_result(None)
+
+    def _insert(self, rows: list) -> None:
+        with self.conn:
+            self.conn.executemany("""
+                INSERT INTO pages (url, domain, title, markdown, content, processing_time, processed_at,
+                                   content_hash, markdown_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    domain = excluded.domain, title = excluded.title, markdown = excluded.markdown,
+                    content = excluded.content, processing_time = excluded.processing_time,
+                    processed_at = excluded.processed_at, content_hash = excluded.content_hash,
+                    markdown_hash = excluded.markdown_hash""", rows)
+
+    # Returns the stored page of a URL, or None
+    def read(self, source_url: str) -> dict | None:
+        with self.lock:
+            self._flush()
+            row = self.conn.execute(
+                "SELECT url, title, processed_at, markdown, content FROM pages WHERE url = ?",
+                (source_url,)).fetchone()
+        if row is None:
+            return None
+        record = {"title": row[1], "source_url": row[0], "processed_at": row[2]}
+        if row[3] is not None:
+            record["markdown"] = row[3]
+        if row[4] is not None:
+            record["content"] = json.loads(row[4])
+        return record
+
+    def close(self) -> None:
+        with self.lock:
+            self._flush()
+            self.conn.close()
+
+# Writes the result records of a run to a Parquet file (<directory>/<run id>.parquet)
+# together with the page title, Markdown, text length and hashes, for analytics.
+# Rows are written one row group of row_group_size rows at a time by a background
+# thread while the run progresses; close() writes the last, partial row group.
+class ParquetExporter:
+    def __init__(self, directory: str, row_group_size: int):
+        if pyarrow is None:
+            raise RuntimeError("parquet_dir is set but pyarrow is not installed (pip install pyarrow).")
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.parquet")
+        self.row_group_size = row_group_size
+        self.schema = pyarrow.schema([
+            ("url", pyarrow.string()),
+            ("domain", pyarrow.string()),
+            ("status", pyarrow.string()),
+            ("error_message", pyarrow.string()),
+            ("processing_time", pyarrow.float64()),
+            ("rate_limit_wait", pyarrow.float64()),
+            ("title", pyarrow.string()),
+            ("markdown", pyarrow.string()),
+            ("text_length", pyarrow.int64()),
+            ("content_hash", pyarrow.string()),
+            ("markdown_hash", pyarrow.string()),
+            ("finished_at", pyarrow.string())
+        ])
+        self.rows = []
+        self.writer = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    # Adds the result record of a job, with its exported page when there is one
+    def add(self, record: dict, exported: dict | None, content_hash: str | None) -> None:
+        markdown = exported["markdown"] if exported is not None else None
+        self.rows.append({
+            "url": record["url"],
+            "domain": get_primary_domain(get_url_domain(record["url"])),
+            "status": record["status"],
+            "error_message": record["error_message"],
+            "processing_time": record["processing_time"],
+            "rate_limit_wait": record["rate_limit_wait"],
+            "title": exported["title"] if exported is not None else None,
+            "markdown": markdown,
+            "text_length": len(markdown) if markdown is not None else None,
+            "content_hash": content_hash,
+            "markdown_hash": None,
+            "finished_at": datetime.datetime.now().isoformat()
+        })
+        if len(self.rows) >= self.row_group_size:
+            rows, self.rows = self.rows, []
+            self.executor.submit(self.write_rows, rows)
+
+    def write_rows(self, rows: list) -> None:
+        try:
+            for row in rows:
+                if row["markdown"] is not None:
+                    row["markdown_hash"] = hashlib.sha256(row["markdown"].encode("utf-8")).hexdigest()
+            if self.writer is None:
+                self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression="zstd")
+            self.writer.write_table(pyarrow.Table.from_pylist(rows, schema=self.schema))
+        except Exception as e:
+            logging.error(f"Error writing Parquet file: {self.path}. Details: {e}")
+
+    def close(self) -> None:
+        if self.rows:
+            self.executor.submit(self.write_rows, self.rows)
+            self.rows = []
+        self.executor.shutdown()
+        if self.writer is not None:
+            self.writer.close()
+            logging.info(f"Parquet export saved in: {self.path}")
+
+# Reads back one record of a shard from its offset and length
+def read_shard_record(path: str, offset: int, length: int) -> dict:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    if path.endswith(".gz"):
+        data = gzip.decompress(data)
+    elif path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read .zst shards (pip install zstandard).")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    return json.loads(data)
+
+# Returns the installed docling version, part of the conversion cache key
+def get_docling_version() -> str:
     try:
-        json_raw = result.document.export_to_json()
-        json_data["content"] = json.loads(json_raw)
-    except Exception:
+        return importlib.metadata.version("docling")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+# On-disk cache of exported conversions keyed by a hash of the page body, the file
+# name handed to docling, the docling version, CONVERTER_OPTIONS and the export
+# options (formats, chunking). A page whose body is byte-identical to an earlier one is served from here
+# without being converted. Entries are evicted least recently used first once the cache grows
+# past max_bytes; file modification times carry the usage order across runs.
+class ConversionCache:
+    def __init__(self, directory: str, max_bytes: int, options: list):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.salt = json.dumps([get_docling_version(), CONVERTER_OPTIONS, options], sort_keys=True).encode()
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+
+    # Returns the cache key of a page body
+    def key(self, content: bytes, name: str) -> str:
+        digest = hashlib.sha256(self.salt)
+        digest.update(os.path.splitext(name)[1].encode())
+        digest.update(content)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    # Returns the cached export of a key, or None
+    def get(self, key: str) -> dict | None:
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
         try:
-            doc_dict = result.document.to_dict()
-            json_data["content"] = doc_dict
-        except Exception:
-            json_data["content"] = {"error": "Failed to export the document."}
-    
-    json_file = os.path.join(site_dir, f"{page_title}.json")
-    with open(json_file, "w", encoding="utf-8") as f:
-        f.write(json.dumps(json_data, indent=2, ensure_ascii=False))
-    
-    logging.info(f"Files saved in: {site_dir}")
+            with open(self.path(key), "r", encoding="utf-8") as f:
+                exported = json.load(f)
+            os.utime(self.path(key))
+            return exported
+        except (OSError, ValueError) as e:
+            logging.warning(f"Discarding unreadable cache entry {key}: {e}")
+            self.discard(key)
+            return None
+
+    def put(self, key: str, exported: dict) -> None:
+        data = json.dumps(exported, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        temp_path = f"{self.path(key)}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self.path(key))
+        with self.lock:
+            self.size += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            evicted = []
+            while self.size > self.max_bytes:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self.path(old_key))
+            except OSError:
+                pass
+
+    def discard(self, key: str) -> None:
+        with self.lock:
+            self.size -= self.entries.pop(key, 0)
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+# Chunkers of the threads running the chunk stage, with the tokenizer counting tokens
+_chunkers = threading.local()
 
-# Processes a single URL and returns its result information
-def process_url(url: str, base_dir: str) -> tuple:
-    start_time = time.perf_counter()
+# Returns the calling thread's chunker and tokenizer, creating them on first use.
+# "hybrid" uses docling's HybridChunker with a Hugging Face tokenizer, which also
+# counts the tokens of each chunk; "hierarchical" uses the HierarchicalChunker and
+# counts whitespace-separated tokens.
+def get_chunker(chunker: str, tokenizer_name: str, max_tokens: int) -> tuple:
+    if getattr(_chunkers, "chunker", None) is None:
+        if chunker == "hybrid":
+            from docling.chunking import HybridChunker
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+            options = {"tokenizer": tokenizer}
+            if max_tokens > 0:
+                options["max_tokens"] = max_tokens
+            _chunkers.chunker = HybridChunker(**options)
+            _chunkers.count_tokens = lambda text: len(tokenizer.tokenize(text))
+        else:
+            from docling.chunking import HierarchicalChunker
+            _chunkers.chunker = HierarchicalChunker()
+            _chunkers.count_tokens = lambda text: len(text.split())
+    return _chunkers.chunker, _chunkers.count_tokens
+
+# Splits a converted document into chunks ready to embed: the text of each chunk
+# with its headings as context, the heading path and the token count
+def chunk_document(document, chunker: str, tokenizer_name: str, max_tokens: int) -> list:
+    doc_chunker, count_tokens = get_chunker(chunker, tokenizer_name, max_tokens)
+    chunks = []
+    for chunk in doc_chunker.chunk(dl_doc=document):
+        text = doc_chunker.serialize(chunk=chunk)
+        chunks.append({
+            "text": text,
+            "headings": list(chunk.meta.headings or []),
+            "token_count": count_tokens(text)
+        })
+    return chunks
+
+# Deterministic stand-in embedder for tests and dry runs (embedder = hash): hashes
+# each lowercased word into one of `dim` buckets with a random sign and returns
+# the L2-normalized counts
+def hash_embedding(texts: list, dim: int = 256) -> numpy.ndarray:
+    vectors = numpy.zeros((len(texts), dim), dtype=numpy.float32)
+    for row, text in enumerate(texts):
+        for word in text.lower().split():
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % dim
+            vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+    norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / numpy.maximum(norms, 1e-12)
+
+# Returns the embedding function named by the embedder setting: "hash" for the
+# built-in stand-in, or "module:callable" for a plugin. The function receives a list
+# of texts and returns one vector per text (an array of shape (len(texts), dim)).
+def load_embedder(spec: str, dim: int):
+    if spec == "hash":
+        return lambda texts: hash_embedding(texts, dim)
+    module_name, _, attribute = spec.partition(":")
+    if not module_name or not attribute:
+        raise ValueError(f"Invalid embedder '{spec}'; expected 'hash' or 'module:callable'.")
+    return getattr(importlib.import_module(module_name), attribute)
+
+# Writes the .npy header of a float32 matrix, padded to NPY_HEADER_SIZE bytes
+def write_npy_header(f, rows: int, dim: int) -> None:
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dim)
+    header = header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+    f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+
+# Appends chunk records (source_url, chunk_index, text, headings, token_count) to a
+# JSON lines file per run (<directory>/chunks-<run id>.jsonl). Records are buffered
+# and written batch_size at a time, or flush_interval seconds after the first record
+# of a batch was buffered; each page gets a future resolved once its chunks are
+# written. With an embedder, each batch is embedded
+# embedding_batch_size texts per call and its vectors are appended to
+# chunks-<run id>.npy, a float32 matrix with one row per chunk; each record names
+# its row in `vector_row` (load it with numpy.load(path, mmap_mode="r")).
+class ChunkWriter:
+    def __init__(self, directory: str, batch_size: int, embedder=None, embedding_batch_size: int = 64,
+                 flush_interval: float = 1.0):
+        os.makedirs(directory, exist_ok=True)
+        run_id = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(directory, f"chunks-{run_id}.jsonl")
+        self.vectors_path = os.path.join(directory, f"chunks-{run_id}.npy")
+        self.batch_size = batch_size
+        self.embedder = embedder
+        self.embedding_batch_size = embedding_batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.futures = []
+        self.timer = None
+        self.rows = 0
+        self.dim = None
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    # Buffers the chunks of a page and returns its future
+    def add(self, source_url: str, chunks: list) -> Future:
+        future = Future()
+        with self.lock:
+            for index, chunk in enumerate(chunks):
+                self.pending.append(dict(source_url=source_url, chunk_index=index, **chunk))
+            self.futures.append(future)
+            if len(self.pending) < self.batch_size:
+                if self.timer is None:
+                    self.timer = threading.Timer(self.flush_interval, self.flush)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return future
+            records, futures = self.take()
+        self.write_batch(records, futures)
+        return future
+
+    # Takes the buffered records and their futures; called with the buffer lock held
+    def take(self) -> tuple:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        records, self.pending = self.pending, []
+        futures, self.futures = self.futures, []
+        return records, futures
+
+    # Writes whatever is buffered
+    def flush(self) -> None:
+        with self.lock:
+            records, futures = self.take()
+        if futures:
+            self.write_batch(records, futures)
+
+    # Embeds a batch of records (outside the buffer lock, so other pages can keep
+    # adding chunks meanwhile) and appends records and vectors in the same order,
+    # then resolves the futures of their pages
+    def write_batch(self, records: list, futures: list) -> None:
+        vectors = None
+        if self.embedder is not None:
+            texts = [record["text"] for record in records]
+            try:
+                vectors = numpy.concatenate([
+                    numpy.asarray(self.embedder(texts[start:start + self.embedding_batch_size]), dtype=numpy.float32)
+                    for start in range(0, len(texts), self.embedding_batch_size)])
+            except Exception as e:
+                logging.error(f"Error embedding {len(records)} chunk(s); saving them without vectors. Details: {e}")
+        with self.write_lock:
+            if vectors is not None:
+                try:
+                    self.append_vectors(vectors, records)
+                except ValueError as e:
+                    logging.error(f"Error saving vectors of {len(records)} chunk(s). Details: {e}")
+            lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            except OSError as e:
+                logging.error(f"Error writing {len(records)} chunk(s) to {self.path}. Details: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                return
+        for future in futures:
+            future.set_result(None)
+
+    def append_vectors(self, vectors: numpy.ndarray, records: list) -> None:
+        if vectors.ndim != 2 or len(vectors) != len(records):
+            raise ValueError(f"Embedder returned shape {vectors.shape} for {len(records)} chunks.")
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            with open(self.vectors_path, "wb") as f:
+                write_npy_header(f, 0, self.dim)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedder returned {vectors.shape[1]} dimensions instead of {self.dim}.")
+        for offset, record in enumerate(records):
+            record["vector_row"] = self.rows + offset
+        with open(self.vectors_path, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            f.write(numpy.ascontiguousarray(vectors, dtype="<f4").tobytes())
+            self.rows += len(records)
+            f.seek(0)
+            write_npy_header(f, self.rows, self.dim)
+
+    def close(self) -> None:
+        self.flush()
+
+# Converter owned by the current worker process; built once and reused for every URL
+_converter = None
+
+# Returns the worker's DocumentConverter, creating it on first use
+def get_converter() -> DocumentConverter:
+    global _converter
+    if _converter is None:
+        _converter = DocumentConverter()
+    return _converter
+
+# Pool initializer: warms up the worker by building its converter before the first URL arrives
+def init_worker() -> None:
+    get_converter()
+
+# Configures the log format shared by the main process and the workers
+def setup_logging() -> None:
+    logging.basicConfig(level=logging.INFO, 
+                        format="%(asctime)s - %(levelname)s - %(message)s",
+                        datefmt="%Y-%m-%d %H:%M:%S")
+
+# Returns the resident memory of the current process in bytes. Falls back to the
+# peak RSS where /proc is not available.
+def get_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+# Entry point of a worker process: warms up the converter, signals readiness and
+# then runs the tasks sent by the parent until it receives None or the pipe closes.
+# Every reply carries the worker's current RSS so the parent can recycle it.
+def worker_loop(conn) -> None:
+    setup_logging()
+    init_worker()
+    conn.send("ready")
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        func, args = task
+        try:
+            value = func(*args)
+            ok = True
+        except Exception as e:
+            value = str(e)
+            ok = False
+        conn.send((ok, value, get_rss_bytes()))
+    conn.close()
+
+# A worker process and the parent's end of its pipe
+class Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.tasks = 0
+
+    # Blocks until the worker has finished building its converter
+    def wait_ready(self) -> None:
+        if not self.ready:
+            self.conn.recv()
+            self.ready = True
+
+    # Asks an idle worker to exit, killing it if it doesn't (or is still warming up)
+    def stop(self) -> None:
+        if self.ready:
+            try:
+                self.conn.send(None)
+                self.process.join(5)
+            except OSError:
+                pass
+        self.kill()
+
+    # Kills the process immediately, whatever it is doing
+    def kill(self) -> None:
+        self.process.terminate()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+# Pool of long-lived, warm worker processes. Unlike ProcessPoolExecutor, a task
+# that exceeds its timeout gets its worker killed and replaced by a fresh one,
+# so a hung conversion never holds up the rest of the batch.
+# To keep memory flat on long runs, a worker is also replaced once it has run
+# max_tasks tasks or its RSS exceeds max_rss bytes (0 disables either limit).
+# This only happens between tasks, after the result has been handed back.
+class WorkerPool:
+    def __init__(self, size: int, max_tasks: int = 0, max_rss: int = 0):
+        self._max_tasks = max_tasks
+        self._max_rss = max_rss
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> Worker:
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=worker_loop, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        return Worker(process, parent_conn)
+
+    # Runs func(*args) on an idle worker and returns its result. Raises TimeoutError
+    # if the call takes longer than timeout seconds (converter warm-up not included)
+    # and RuntimeError if the call fails or the worker dies.
+    def run(self, func, args: tuple, timeout: float):
+        worker = self._idle.get()
+        timed_out = False
+        try:
+            worker.wait_ready()
+            worker.conn.send((func, args))
+            if worker.conn.poll(timeout):
+                ok, value, rss = worker.conn.recv()
+                worker.tasks += 1
+                worker = self._recycle(worker, rss)
+            else:
+                timed_out = True
+        except (EOFError, OSError) as e:
+            logging.error(f"Worker {worker.process.pid} exited unexpectedly; replacing it.")
+            worker.kill()
+            worker = self._spawn()
+            raise RuntimeError(f"Worker process exited unexpectedly: {e}")
+        finally:
+            if timed_out:
+                logging.warning(f"Worker {worker.process.pid} timed out; replacing it.")
+                worker.kill()
+                worker = self._spawn()
+            self._idle.put(worker)
+        if timed_out:
+            raise TimeoutError(f"Timeout after {format_time(timeout)}")
+        if not ok:
+            raise RuntimeError(value)
+        return value
+
+    # Replaces a worker that reached its task or memory limit; returns the worker
+    # to put back in the pool
+    def _recycle(self, worker: Worker, rss: int) -> Worker:
+        if self._max_tasks and worker.tasks >= self._max_tasks:
+            reason = f"after {worker.tasks} tasks"
+        elif self._max_rss and rss > self._max_rss:
+            reason = f"at {rss // (1024 * 1024)} MB RSS"
+        else:
+            return worker
+        logging.info(f"Recycling worker {worker.process.pid} {reason}.")
+        worker.stop()
+        return self._spawn()
+
+    # Stops all workers, letting idle ones exit cleanly
+    def close(self) -> None:
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+
+# Converts a downloaded page and returns the DoclingDocument; runs inside a worker process
+def convert_page(url: str, content: bytes, name: str):
     logging.info(f"Starting conversion for URL: {url}")
+    stream = DocumentStream(name=name, stream=BytesIO(content))
+    return get_converter().convert(stream).document
+
+# Builds the HTTP session shared by all downloads; its connection pool is sized so
+# every concurrent download can keep its connection alive between pages
+def create_session(pool_size: int) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+# Downloads a page; `headers` carries conditional request validators, in which case
+# the response may be a 304 without a body
+def fetch_page(session: requests.Session, url: str, headers: dict | None = None) -> requests.Response:
+    response = session.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+    response.raise_for_status()
+    return response
+
+# Tells whether a download failure is worth retrying: connection errors, timeouts,
+# 5xx responses and 429 (Too Many Requests)
+def is_transient_error(error: Exception) -> bool:
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return False
+
+# Returns the delay before retry number `attempt` (1-based): exponential backoff
+# with full jitter, capped at RETRY_MAX_DELAY
+def get_retry_delay(attempt: int, base_delay: float) -> float:
+    return random.uniform(0, min(RETRY_MAX_DELAY, base_delay * 2 ** (attempt - 1)))
+
+# Raised instead of processing a URL whose primary domain's circuit is open
+class CircuitOpenError(Exception):
+    pass
+
+# Per-domain circuit breaker. After `threshold` consecutive failed URLs the circuit
+# opens and the domain's URLs are skipped for `cooldown` seconds. Then a single URL
+# is let through as a probe: success closes the circuit, failure reopens it.
+class CircuitBreaker:
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if not self.probing and time.monotonic() - self.opened_at >= self.cooldown:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.threshold and (self.probing or self.failures >= self.threshold):
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+# Token bucket limiting the request rate of one primary domain. Each request
+# reserves a token; when none is left it waits until its token has been refilled,
+# so concurrent callers are served in order at `rate` requests per second, with
+# bursts of up to `burst` requests.
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    # Waits for a token and returns the time spent waiting, in seconds
+    async def acquire(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        delay = -self.tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+# Returns the file name handed to docling with a downloaded page, so it can detect
+# the format from the extension (e.g. "cursos.html")
+def get_stream_name(url: str, content_type: str) -> str:
+    name = sanitize_filename(os.path.basename(urlparse(url).path.rstrip("/")) or "index")
+    mime = content_type.split(";")[0].strip().lower()
+    extension = mimetypes.guess_extension(mime) if mime else None
+    if extension:
+        if not name.lower().endswith(extension):
+            name += extension
+    elif not os.path.splitext(name)[1]:
+        name += ".html"
+    return name
+
+# Reorders URLs round-robin across primary domains (keeping each domain's order),
+# so the pages of one big site don't queue up in front of everything else
+def interleave_domains(urls: list) -> list:
+    pending = {}
+    for url in urls:
+        pending.setdefault(get_primary_domain(get_url_domain(url)), deque()).append(url)
+    ordered = []
+    while pending:
+        for primary in list(pending):
+            ordered.append(pending[primary].popleft())
+            if not pending[primary]:
+                del pending[primary]
+    return ordered
+
+# Runtime settings, read from the environment (.env) by load_settings
+@dataclass
+class Settings:
+    base_dir: str = "scraping_data"
+    webhook_url: str = ""
+    mode: str = "development"
+    workers: int = 1
+    workers_per_domain: int = 2
+    fetch_concurrency: int = 64
+    export_workers: int = 2
+    write_workers: int = 4
+    queue_size: int = 32
+    worker_max_tasks: int = 1000
+    worker_max_memory_mb: int = 2048
+    journal_file: str = "scraping_data/journal.jsonl"
+    poll_interval: float = 1.0
+    daemon_batch_size: int = 1000
+    server_host: str = "127.0.0.1"
+    server_port: int = 8000
+    fetch_retries: int = 3
+    retry_base_delay: float = 1.0
+    breaker_threshold: int = 5
+    breaker_cooldown: float = 300.0
+    rate_limit: float = 0.0
+    rate_limit_burst: float = 1.0
+    rate_limit_overrides: dict = field(default_factory=dict)
+    state_db: str = "scraping_data/state.db"
+    conditional_requests: bool = True
+    cache_dir: str = "scraping_data/cache"
+    canonicalize_urls: bool = True
+    sitemaps: list = field(default_factory=list)
+    crawl_depth: int = 0
+    crawl_max_pages: int = 1000
+    crawl_db: str = "scraping_data/crawl.db"
+    io_queue_size: int = 256
+    fsync_every: int = 100
+    fsync_interval: float = 1.0
+    output_db: str = ""
+    output_db_batch: int = 100
+    shard_by: str = "none"
+    chunker: str = "none"
+    chunk_tokenizer: str = "sentence-transformers/all-MiniLM-L6-v2"
+    chunk_max_tokens: int = 0
+    chunk_dir: str = "scraping_data/chunks"
+    chunk_batch_size: int = 256
+    embedder: str = ""
+    embedding_batch_size: int = 64
+    embedding_dim: int = 256
+    parquet_dir: str = ""
+    parquet_row_group: int = 1000
+    shard_dir: str = "scraping_data/shards"
+    shard_max_mb: int = 256
+    shard_compression: str = "gzip"
+    output: OutputOptions = field(default_factory=OutputOptions)
+    conversion_cache_mb: int = 1024
+
+# Append-only JSONL journal of finished URLs. Each result record is written as
+# soon as its URL finishes, so an interrupted run can be resumed: completed URLs
+# are skipped and their records are taken from the journal for the final payload.
+# The journal is removed once a run has been fully reported.
+class Journal:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    # Returns the (domain, record) entries journaled for the given URLs, or for all
+    # URLs when urls is None. A line truncated by a crash is ignored.
+    def load(self, urls: list | None) -> list:
+        if not os.path.exists(self.path):
+            return []
+        wanted = set(urls) if urls is not None else None
+        entries = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    url = entry["record"]["url"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if wanted is None or url in wanted:
+                    entries[url] = (entry["domain"], entry["record"])
+        return list(entries.values())
+
+    def append(self, domain: str, record: dict) -> None:
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(json.dumps({"domain": domain, "record": record}, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Deletes the journal once its run is complete
+    def remove(self) -> None:
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# Local SQLite store of per-URL state kept between runs: the HTTP validators
+# (ETag / Last-Modified) of each converted page together with the files saved for
+# it, so unchanged pages can be skipped with a conditional request, and the time of
+# each URL's last successful run, compared with sitemap lastmod dates.
+# Only used from the pipeline's event loop thread; writes are committed in batches.
+class StateStore:
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS validators (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                files TEXT,
+                updated_at TEXT
+            )""")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS last_success (
+                url TEXT PRIMARY KEY,
+                finished_at TEXT
+            )""")
+        self.conn.commit()
+        self.pending_writes = 0
+
+    # Returns when a URL was last processed successfully (UTC), or None
+    def get_last_success(self, url: str) -> datetime.datetime | None:
+        row = self.conn.execute("SELECT finished_at FROM last_success WHERE url = ?", (url,)).fetchone()
+        return datetime.datetime.fromisoformat(row[0]) if row else None
+
+    def record_success(self, url: str) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO last_success (url, finished_at) VALUES (?, ?)",
+                          (url, datetime.datetime.now(datetime.timezone.utc).isoformat()))
+        self.pending_writes += 1
+        if self.pending_writes >= STATE_COMMIT_EVERY:
+            self.commit()
+
+    # Returns the validators and saved files of a URL, or None
+    def get_validators(self, url: str) -> dict | None:
+        row = self.conn.execute(
+            "SELECT etag, last_modified, files FROM validators WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "files": json.loads(row[2] or "{}")}
+
+    def save_validators(self, url: str, etag: str | None, last_modified: str | None, files: dict) -> None:
+        if not etag and not last_modified:
+            self.conn.execute("DELETE FROM validators WHERE url = ?", (url,))
+        else:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO validators (url, etag, last_modified, files, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, etag, last_modified, json.dumps(files), datetime.datetime.now().isoformat()))
+        self.pending_writes += 1
+        if self.pending_writes >= STATE_COMMIT_EVERY:
+            self.commit()
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self.pending_writes = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.close()
+
+# A group of URLs submitted together (a whole run, the lines claimed in one poll
+# of the daemon, or a job of the HTTP API). Collects the result records of its
+# URLs as they finish, grouped by primary domain, and the paths of the files
+# saved for each URL. Records are journaled when a journal is given and passed
+# to on_record when it is set; on_job, when set, is called with each finished
+# job and its record.
+class Batch:
+    def __init__(self, total: int, journal: Journal | None = None):
+        self.total = total
+        self.journal = journal
+        self.processed_data = {}
+        self.outputs = {}
+        self.on_record = None
+        self.on_job = None
+        self.started = 0
+        self.finished = 0
+        self.done = asyncio.Event()
+        if total == 0:
+            self.done.set()
+
+    def add_record(self, domain: str, result_data: dict, persist: bool = True) -> None:
+        primary = get_primary_domain(domain)
+        if primary in self.processed_data:
+            self.processed_data[primary].append(result_data)
+        else:
+            self.processed_data[primary] = [result_data]
+        if not persist:
+            return
+        # Short-circuited URLs were never attempted, so a resumed run retries them
+        if self.journal is not None and result_data["status"] != "short_circuited":
+            self.journal.append(domain, result_data)
+        if self.on_record is not None:
+            self.on_record(result_data)
+        self.finished += 1
+        if self.finished >= self.total:
+            self.done.set()
+
+    # Counts jobs submitted after the batch was created, such as offline pages that
+    # are only known once read
+    def extend(self, count: int) -> None:
+        self.total += count
+        if self.finished < self.total:
+            self.done.clear()
+
+    # Adds the records of URLs completed by an interrupted earlier run
+    def restore(self, entries: list) -> None:
+        for domain, result_data in entries:
+            self.add_record(domain, result_data, persist=False)
+
+    # Waits until every URL of the batch has a result record
+    async def wait(self) -> dict:
+        await self.done.wait()
+        return self.processed_data
+
+# A URL travelling through the pipeline; each stage fills in its output and
+# drops the previous stage's data so large pages are freed as early as possible
+@dataclass
+class PageJob:
+    url: str
+    batch: Batch
+    start_time: float = 0.0
+    name: str | None = None
+    content: bytes | None = None
+    document: object = None
+    exported: dict | None = None
+    rate_limit_wait: float = 0.0
+    etag: str | None = None
+    last_modified: str | None = None
+    cache_key: str | None = None
+    content_hash: str | None = None
+    depth: int | None = None
+    links: list | None = None
+    finished: bool = False
+
+# Fetch -> convert -> export -> write pipeline. Each stage runs its own number of
+# concurrent tasks and hands jobs to the next one through a bounded queue, so a
+# slow stage applies backpressure upstream instead of letting pages pile up in
+# memory:
+# - fetch: `fetch_concurrency` downloads on pooled keep-alive connections, at most
+#   `workers_per_domain` per primary domain
+# - convert: `workers` conversions on the warm worker pool
+# - export: `export_workers` threads running the Markdown/JSON exports
+# - chunk (only when `chunker` is set): chunking of the document, on the export threads
+# - write: `write_workers` threads saving the files
+# The pipeline is started once and can then take URLs for any number of batches
+# until it is stopped.
+class Pipeline:
+    def __init__(self, pool: WorkerPool, settings: Settings):
+        self.pool = pool
+        self.settings = settings
+        self.session = create_session(settings.fetch_concurrency)
+        self.fetch_executor = ThreadPoolExecutor(max_workers=settings.fetch_concurrency)
+        self.convert_executor = ThreadPoolExecutor(max_workers=settings.workers)
+        self.export_executor = ThreadPoolExecutor(max_workers=settings.export_workers)
+        self.write_executor = ThreadPoolExecutor(max_workers=settings.write_workers)
+        self.domain_slots = {}
+        self.breakers = {}
+        self.rate_limiters = {}
+        self.state = StateStore(settings.state_db)
+        self.file_writer = FileWriter(settings.io_queue_size, settings.fsync_every, settings.fsync_interval)
+        self.commit_tasks = set()
+        self.database = None
+        self.shards = None
+        self.chunk_writer = None
+        if settings.chunker != "none":
+            embedder = load_embedder(settings.embedder, settings.embedding_dim) if settings.embedder else None
+            self.chunk_writer = ChunkWriter(settings.chunk_dir, settings.chunk_batch_size, embedder,
+                                            settings.embedding_batch_size, settings.fsync_interval)
+        self.parquet = None
+        if settings.parquet_dir:
+            self.parquet = ParquetExporter(settings.parquet_dir, settings.parquet_row_group)
+        if settings.output_db:
+            self.database = OutputDatabase(settings.output_db, settings.output_db_batch, settings.fsync_interval)
+        elif settings.shard_by != "none":
+            self.shards = ShardWriter(settings.shard_dir, settings.shard_by, settings.shard_max_mb * 1024 * 1024,
+                                      settings.shard_compression, settings.output)
+        self.cache = None
+        if settings.conversion_cache_mb > 0:
+            self.cache = ConversionCache(
+                settings.cache_dir, settings.conversion_cache_mb * 1024 * 1024,
+                [settings.output.formats, settings.output.json_markdown,
+                 settings.chunker, settings.chunk_tokenizer, settings.chunk_max_tokens])
+        self.fetch_queue = None
+        self.stages = None
+
+    # Returns the semaphore limiting concurrent requests to a primary domain
+    def domain_slot(self, primary: str) -> asyncio.Semaphore:
+        if primary not in self.domain_slots:
+            self.domain_slots[primary] = asyncio.Semaphore(self.settings.workers_per_domain)
+        return self.domain_slots[primary]
+
+    # Returns the circuit breaker of a primary domain
+    def breaker(self, primary: str) -> CircuitBreaker:
+        if primary not in self.breakers:
+            self.breakers[primary] = CircuitBreaker(self.settings.breaker_threshold,
+                                                    self.settings.breaker_cooldown)
+        return self.breakers[primary]
+
+    # Returns the token bucket of a primary domain (rate_limit_overrides, else rate_limit)
+    def rate_limiter(self, primary: str) -> TokenBucket:
+        if primary not in self.rate_limiters:
+            rate = self.settings.rate_limit_overrides.get(primary, self.settings.rate_limit)
+            self.rate_limiters[primary] = TokenBucket(rate, self.settings.rate_limit_burst)
+        return self.rate_limiters[primary]
+
+    async def fetch(self, job: PageJob) -> None:
+        job.batch.started += 1
+        logging.info(f"Processing URL {job.batch.started} of {job.batch.total}")
+        job.start_time = time.perf_counter()
+        primary = get_primary_domain(get_url_domain(job.url))
+        if job.content is not None:
+            # Page submitted with its body (e.g. raw HTML posted to the job API)
+            if not self.breaker(primary).allow():
+                raise CircuitOpenError(f"Skipped: too many consecutive failures on {primary}")
+            job.name = get_stream_name(job.url, "text/html")
+            return
+        # Ask the server to skip the body if the page is unchanged since the last
+        # conversion, as long as the files saved back then are still there
+        headers = {}
+        # Crawled pages whose links are still needed are always downloaded in full
+        wants_links = job.depth is not None and job.depth < self.settings.crawl_depth
+        previous = None
+        if self.settings.conditional_requests and not wants_links:
+            previous = self.state.get_validators(job.url)
+        if previous and previous["files"] and all(os.path.exists(path) for path in get_output_paths(previous["files"])):
+            if previous["etag"]:
+                headers["If-None-Match"] = previous["etag"]
+            if previous["last_modified"]:
+                headers["If-Modified-Since"] = previous["last_modified"]
+        loop = asyncio.get_running_loop()
+        # The domain slot is held through the retries, so a struggling domain gets
+        # fewer requests while backing off, and URLs queued behind a failing one
+        # only check the circuit once its failure has been recorded
+        async with self.domain_slot(primary):
+            if not self.breaker(primary).allow():
+                raise CircuitOpenError(f"Skipped: too many consecutive failures on {primary}")
+            attempt = 0
+            while True:
+                try:
+                    job.rate_limit_wait += await self.rate_limiter(primary).acquire()
+                    response = await loop.run_in_executor(
+                        self.fetch_executor, fetch_page, self.session, job.url, headers)
+                    break
+                except Exception as e:
+                    attempt += 1
+                    if attempt > self.settings.fetch_retries or not is_transient_error(e):
+                        raise
+                    delay = get_retry_delay(attempt, self.settings.retry_base_delay)
+                    logging.warning(f"Download of {job.url} failed ({e}); retry {attempt} of "
+                                    f"{self.settings.fetch_retries} in {delay:.1f} seconds.")
+                    await asyncio.sleep(delay)
+        if response.status_code == 304:
+            logging.info(f"Unchanged since last run: {job.url}")
+            job.batch.outputs[job.url] = previous["files"]
+            self.finish(job, "unchanged", None)
+            return
+        job.content = response.content
+        job.etag = response.headers.get("ETag")
+        job.last_modified = response.headers.get("Last-Modified")
+        job.name = get_stream_name(job.url, response.headers.get("Content-Type", ""))
+        if wants_links and "html" in response.headers.get("Content-Type", "text/html").lower():
+            job.links = await loop.run_in_executor(self.fetch_executor, extract_links, job.content, response.url)
+
+    async def convert(self, job: PageJob) -> None:
+        loop = asyncio.get_running_loop()
+        job.content_hash = hashlib.sha256(job.content).hexdigest()
+        if self.cache is not None:
+            job.cache_key = self.cache.key(job.content, job.name)
+            job.exported = await loop.run_in_executor(self.export_executor, self.cache.get, job.cache_key)
+            if job.exported is not None:
+                logging.info(f"Conversion cache hit for URL: {job.url}")
+                job.content = None
+                return
+        job.document = await loop.run_in_executor(
+            self.convert_executor, self.pool.run,
+            convert_page, (job.url, job.content, job.name), URL_TIMEOUT)
+        job.content = None
+
+    async def export(self, job: PageJob) -> None:
+        if job.exported is not None:
+            return
+        loop = asyncio.get_running_loop()
+        job.exported = await loop.run_in_executor(
+            self.export_executor, export_document, job.document, self.settings.output)
+        if self.settings.chunker == "none":
+            job.document = None
+            await self.cache_export(job)
+
+    # Adds the chunks of the document to its export; runs after export when chunking is on.
+    # Chunking is optional: when it fails the page is still written, without chunks
+    # (and is not cached, so a later run chunks it again).
+    async def chunk(self, job: PageJob) -> None:
+        if job.document is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            job.exported["chunks"] = await loop.run_in_executor(
+                self.export_executor, chunk_document, job.document, self.settings.chunker,
+                self.settings.chunk_tokenizer, self.settings.chunk_max_tokens)
+        except Exception as e:
+            logging.error(f"Error chunking URL: {job.url}. Details: {e}")
+            job.document = None
+            return
+        job.document = None
+        await self.cache_export(job)
+
+    async def cache_export(self, job: PageJob) -> None:
+        if self.cache is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.export_executor, self.cache.put, job.cache_key, job.exported)
+
+    async def write(self, job: PageJob) -> None:
+        loop = asyncio.get_running_loop()
+        committed = []
+        if self.database is not None:
+            files, future = await loop.run_in_executor(
+                self.write_executor, self.database.write, job.exported, job.url, job.content_hash,
+                time.perf_counter() - job.start_time)
+            committed = [future]
+        elif self.shards is not None:
+            files = await loop.run_in_executor(self.write_executor, self.shards.write, job.exported, job.url)
+        else:
+            files, committed = await loop.run_in_executor(
+                self.write_executor, save_files, job.exported, self.settings.base_dir, job.url,
+                self.settings.output, self.file_writer)
+        if self.chunk_writer is not None and job.exported.get("chunks"):
+            committed = committed + [await loop.run_in_executor(
+                self.write_executor, self.chunk_writer.add, job.url, job.exported["chunks"])]
+        if committed:
+            # The page is only recorded (and journaled) as a success once its output is
+            # committed (files renamed into place, database row inserted, chunks
+            # written); the write task moves on to the next page meanwhile
+            task = asyncio.ensure_future(self.finish_commit(job, files, committed))
+            self.commit_tasks.add(task)
+            task.add_done_callback(self.commit_tasks.discard)
+            return
+        self.finish_write(job, files)
+
+    # Waits for the output of a page to be committed, then records its outcome
+    async def finish_commit(self, job: PageJob, files: dict, committed: list) -> None:
+        try:
+            await asyncio.gather(*(asyncio.wrap_future(future) for future in committed))
+        except Exception as e:
+            self.finish(job, "error", str(e))
+            job.exported = None
+            return
+        self.finish_write(job, files)
+
+    # Records a page whose output is written
+    def finish_write(self, job: PageJob, files: dict) -> None:
+        job.batch.outputs[job.url] = files
+        if self.settings.conditional_requests:
+            self.state.save_validators(job.url, job.etag, job.last_modified, files)
+        self.finish(job, "success", None)
+        job.exported = None
+
+    # Records the outcome of a job in its batch
+    def finish(self, job: PageJob, status: str, error_message: str | None) -> None:
+        job.finished = True
+        primary = get_primary_domain(get_url_domain(job.url))
+        if status in ("success", "unchanged"):
+            self.breaker(primary).record_success()
+            self.state.record_success(job.url)
+        elif status == "error":
+            self.breaker(primary).record_failure()
+        processing_time = round(time.perf_counter() - job.start_time, 2)
+        formatted_time = format_time(processing_time)
+        logging.info(f"Finished processing {job.url} in {formatted_time}")
+        self.add_record(job, {
+            "url": job.url,
+            "status": status,
+            "processing_time": processing_time,
+            "processing_time_formatted": formatted_time,
+            "error_message": error_message,
+            "rate_limit_wait": round(job.rate_limit_wait, 2)
+        })
+
+    # Adds the result record of a job to its batch and to the Parquet export
+    def add_record(self, job: PageJob, record: dict) -> None:
+        job.batch.add_record(get_url_domain(job.url), record)
+        if self.parquet is not None:
+            self.parquet.add(record, job.exported if record["status"] == "success" else None, job.content_hash)
+        if job.batch.on_job is not None:
+            job.batch.on_job(job, record)
+
+    # Runs `count` tasks applying handler to the jobs from inbox and forwarding them to
+    # outbox. A job whose handler fails gets an error record and goes no further.
+    # Once inbox is exhausted, tells the `next_count` tasks of the next stage to stop.
+    async def run_stage(self, handler, inbox: asyncio.Queue, outbox: asyncio.Queue | None,
+                        count: int, next_count: int) -> None:
+        async def stage_task() -> None:
+            while True:
+                job = await inbox.get()
+                if job is None:
+                    return
+                try:
+                    await handler(job)
+                except CircuitOpenError as e:
+                    logging.warning(f"Short-circuited URL: {job.url}. {e}")
+                    self.finish(job, "short_circuited", str(e))
+                    continue
+                except TimeoutError:
+                    logging.error(f"Timeout after 1 minute for URL: {job.url}")
+                    self.breaker(get_primary_domain(get_url_domain(job.url))).record_failure()
+                    self.add_record(job, {
+                        "url": job.url,
+                        "status": "error",
+                        "processing_time": None,
+                        "processing_time_formatted": "Timeout after 1 minute",
+                        "error_message": "Timeout after 1 minute",
+                        "rate_limit_wait": round(job.rate_limit_wait, 2)
+                    })
+                    continue
+                except Exception as e:
+                    logging.error(f"Error processing URL: {job.url}. Details: {e}")
+                    self.finish(job, "error", str(e))
+                    continue
+                if outbox is not None and not job.finished:
+                    await outbox.put(job)
+
+        await asyncio.gather(*(stage_task() for _ in range(count)))
+        if outbox is not None:
+            for _ in range(next_count):
+                await outbox.put(None)
+
+    # Starts the stage tasks; URLs can then be submitted until stop() is called
+    def start(self) -> None:
+        settings = self.settings
+        self.fetch_queue = asyncio.Queue(settings.queue_size)
+        convert_queue = asyncio.Queue(settings.queue_size)
+        export_queue = asyncio.Queue(settings.queue_size)
+        write_queue = asyncio.Queue(settings.queue_size)
+        stages = [
+            self.run_stage(self.fetch, self.fetch_queue, convert_queue,
+                           settings.fetch_concurrency, settings.workers),
+            self.run_stage(self.convert, convert_queue, export_queue,
+                           settings.workers, settings.export_workers),
+        ]
+        if settings.chunker == "none":
+            stages.append(self.run_stage(self.export, export_queue, write_queue,
+                                         settings.export_workers, settings.write_workers))
+        else:
+            # Chunking shares the export threads
+            chunk_queue = asyncio.Queue(settings.queue_size)
+            stages.append(self.run_stage(self.export, export_queue, chunk_queue,
+                                         settings.export_workers, settings.export_workers))
+            stages.append(self.run_stage(self.chunk, chunk_queue, write_queue,
+                                         settings.export_workers, settings.write_workers))
+        stages.append(self.run_stage(self.write, write_queue, None, settings.write_workers, 0))
+        self.stages = asyncio.gather(*stages)
+
+    # Queues a URL of the given batch; waits while the pipeline is full. When content
+    # is given, it is converted as the page body instead of downloading the URL. Pages
+    # of a crawl carry their depth, and their links are collected while below crawl_depth.
+    async def submit(self, url: str, batch: Batch, content: bytes | None = None, depth: int | None = None) -> None:
+        await self.fetch_queue.put(PageJob(url, batch, content=content, depth=depth))
+
+    # Lets the jobs already submitted finish, then stops the stage tasks
+    async def stop(self) -> None:
+        for _ in range(self.settings.fetch_concurrency):
+            await self.fetch_queue.put(None)
+        await self.stages
+        while self.commit_tasks:
+            await asyncio.gather(*self.commit_tasks)
+
+    # Processes all URLs of a batch, then the (source_url, content) pairs of `pages`
+    # (an iterator of offline pages), and returns their result records grouped by
+    # primary domain
+    async def run(self, urls: list, batch: Batch, pages=None) -> dict:
+        self.start()
+        for url in interleave_domains(urls):
+            await self.submit(url, batch)
+        if pages is not None:
+            await self.submit_pages(pages, batch)
+        await self.stop()
+        return batch.processed_data
+
+    # Queues the (source_url, content) pairs of `pages`, an iterator of offline pages,
+    # as part of batch. Pages are read one at a time off the event loop, so an archive
+    # is never loaded whole and reading waits while the pipeline is full.
+    async def submit_pages(self, pages, batch: Batch) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            page = await loop.run_in_executor(None, next, pages, None)
+            if page is None:
+                break
+            batch.extend(1)
+            await self.submit(page[0], batch, page[1])
+
+    def close(self) -> None:
+        self.fetch_executor.shutdown()
+        self.convert_executor.shutdown()
+        self.export_executor.shutdown()
+        self.write_executor.shutdown()
+        self.file_writer.close()
+        self.session.close()
+        self.state.close()
+        if self.shards is not None:
+            self.shards.close()
+        if self.database is not None:
+            self.database.close()
+        if self.parquet is not None:
+            self.parquet.close()
+        if self.chunk_writer is not None:
+            self.chunk_writer.close()
+
+# Collects the targets of the <a href> links of an HTML page, honouring <base href>
+# and skipping rel="nofollow" links
+class LinkExtractor(HTMLParser):
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.links = []
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        attributes = dict(attrs)
+        if tag == "base" and attributes.get("href"):
+            self.base_url = urljoin(self.base_url, attributes["href"])
+        elif tag == "a" and attributes.get("href"):
+            if "nofollow" not in (attributes.get("rel") or "").lower().split():
+                self.links.append(urljoin(self.base_url, attributes["href"].strip()))
+
+# Returns the distinct http(s) links of a page, without fragments and without links
+# to assets the crawler does not convert
+def extract_links(content: bytes, base_url: str) -> list:
+    parser = LinkExtractor(base_url)
     try:
-        converter = DocumentConverter()
-        result = converter.convert(url)
-        save_files(result, base_dir, url)
-        status = "success"
-        error_message = None
+        parser.feed(content.decode("utf-8", errors="replace"))
+        parser.close()
     except Exception as e:
-        logging.error(f"Error processing URL: {url}. Details: {e}")
-        status = "error"
-        error_message = str(e)
-    end_time = time.perf_counter()
-    processing_time = round(end_time - start_time, 2)
-    formatted_time = format_time(processing_time)
-    domain = urlparse(url).netloc
-    logging.info(f"Finished processing {url} in {formatted_time}")
-    return domain, {
-        "url": url,
-        "status": status,
-        "processing_time": processing_time,
-        "processing_time_formatted": formatted_time,
-        "error_message": error_message
-    }
+        logging.warning(f"Error reading links of {base_url}: {e}")
+    links = {}
+    for link in parser.links:
+        link = urldefrag(link)[0]
+        parsed = urlparse(link)
+        if parsed.scheme not in ("http", "https") or not parsed.netloc:
+            continue
+        if os.path.splitext(parsed.path)[1].lower() in CRAWL_SKIP_EXTENSIONS:
+            continue
+        links[link] = True
+    return list(links)
+
+# In-memory Bloom filter sized for `capacity` items at about 1% false positives.
+# Lets the crawler rule out most new URLs without touching the on-disk seen set.
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+# Persistent crawl frontier in SQLite (crawl_db). URLs waiting to be crawled are
+# taken by priority: lowest depth first, then shortest URL path, then discovery
+# order. Every URL ever queued is kept in the exact `seen` set on disk, fronted by
+# a Bloom filter so most new links are admitted without a lookup. An interrupted
+# crawl resumes where it stopped; clear() forgets a finished crawl. Only used from
+# the event loop thread; writes are committed in batches.
+class CrawlFrontier:
+    def __init__(self, path: str, capacity: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS frontier (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT UNIQUE,
+                depth INTEGER,
+                priority INTEGER,
+                active INTEGER DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS frontier_priority ON frontier (active, priority, seq);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+        """)
+        # URLs handed out before an interruption are crawled again
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'pages'").fetchone()
+        interrupted = self.conn.execute("UPDATE frontier SET active = 0 WHERE active = 1").rowcount
+        self.pages = (row[0] if row else 0) - interrupted
+        self.conn.commit()
+        self.bloom = BloomFilter(capacity)
+        for (url,) in self.conn.execute("SELECT url FROM seen"):
+            self.bloom.add(url)
+        self.resumed = self.pages > 0
+        self.pending_writes = 0
+
+    # Queues a URL unless its key (the URL itself, or its canonical form) was seen
+    # before; returns whether it was queued
+    def add(self, url: str, depth: int, key: str | None = None) -> bool:
+        key = key or url
+        if key in self.bloom and self.conn.execute("SELECT 1 FROM seen WHERE url = ?", (key,)).fetchone():
+            return False
+        self.bloom.add(key)
+        priority = depth * 1000 + min(999, len([part for part in urlparse(url).path.split("/") if part]))
+        self.conn.execute("INSERT OR IGNORE INTO seen (url) VALUES (?)", (key,))
+        self.conn.execute("INSERT OR IGNORE INTO frontier (url, depth, priority) VALUES (?, ?, ?)",
+                          (url, depth, priority))
+        self.written()
+        return True
+
+    # Takes up to `count` URLs to crawl, as (url, depth) pairs
+    def next(self, count: int) -> list:
+        rows = self.conn.execute(
+            "SELECT seq, url, depth FROM frontier WHERE active = 0 ORDER BY priority, seq LIMIT ?",
+            (count,)).fetchall()
+        self.conn.executemany("UPDATE frontier SET active = 1 WHERE seq = ?", [(row[0],) for row in rows])
+        self.pages += len(rows)
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('pages', ?)", (self.pages,))
+        self.written()
+        return [(row[1], row[2]) for row in rows]
+
+    # Removes a crawled URL from the frontier (it stays in the seen set)
+    def done(self, url: str) -> None:
+        self.conn.execute("DELETE FROM frontier WHERE url = ?", (url,))
+        self.written()
+
+    def written(self) -> None:
+        self.pending_writes += 1
+        if self.pending_writes >= STATE_COMMIT_EVERY:
+            self.commit()
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self.pending_writes = 0
+
+    # Forgets a finished crawl, so the next one starts from its seeds again
+    def clear(self) -> None:
+        self.conn.executescript("DELETE FROM frontier; DELETE FROM seen; DELETE FROM meta;")
+        self.commit()
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.close()
+
+# Crawls from the seed URLs: converted pages are taken from the frontier in
+# priority order and their same-site links (same primary domain) are added to it,
+# up to crawl_depth links away from a seed and crawl_max_pages pages in total
+# (0 = no page limit). Shares the pipeline, and so the worker pool, the per-domain
+# limits and the rate limits, with batch mode.
+async def run_crawl(pipeline: Pipeline, seeds: list, batch: Batch, settings: Settings) -> dict:
+    frontier = CrawlFrontier(settings.crawl_db, max(100000, settings.crawl_max_pages * 100))
+    if frontier.resumed:
+        logging.info(f"Resuming crawl: {frontier.pages} page(s) already taken from the frontier.")
+    # Links are deduplicated by canonical form but crawled as found
+    def crawl_key(url: str) -> str:
+        return canonicalize_url(url) if settings.canonicalize_urls else url
+
+    for url in seeds:
+        frontier.add(url, 0, crawl_key(url))
+    in_flight = 0
+    progress = asyncio.Event()
+
+    def on_job(job: PageJob, record: dict) -> None:
+        nonlocal in_flight
+        in_flight -= 1
+        if job.links:
+            primary = get_primary_domain(urlparse(job.url).netloc)
+            added = 0
+            for link in job.links:
+                if get_primary_domain(urlparse(link).netloc) != primary:
+                    continue
+                if frontier.add(link, job.depth + 1, crawl_key(link)):
+                    added += 1
+            if added:
+                logging.info(f"Found {added} new link(s) on {job.url}")
+        frontier.done(job.url)
+        progress.set()
+
+    batch.on_job = on_job
+    pipeline.start()
+    try:
+        while True:
+            room = settings.queue_size
+            if settings.crawl_max_pages > 0:
+                room = min(room, settings.crawl_max_pages - frontier.pages)
+            entries = frontier.next(room) if room > 0 else []
+            if not entries:
+                if in_flight == 0:
+                    break
+                progress.clear()
+                await progress.wait()
+                continue
+            for url, depth in entries:
+                in_flight += 1
+                batch.total += 1
+                await pipeline.submit(url, batch, depth=depth)
+        await pipeline.stop()
+        logging.info(f"Crawl finished after {frontier.pages} page(s).")
+        frontier.clear()
+    finally:
+        frontier.close()
+    return batch.processed_data
+
+# Tails the URLs file for the daemon. New complete lines are claimed under an
+# exclusive lock on the file, so a line is never read half-written and the file
+# is never cleared while lines are being claimed. The offset of the last line
+# whose URLs have all finished is saved next to the file (urls.txt.offset), so a
+# restarted daemon resumes from there; URLs claimed but not finished when it
+# stopped are processed again.
+class UrlFeed:
+    def __init__(self, path: str):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.committed = self._load_offset()
+        self.claimed = self.committed
+        self.pending = []
+
+    def _load_offset(self) -> int:
+        try:
+            with open(self.offset_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _save_offset(self) -> None:
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(self.committed))
+        os.replace(tmp_path, self.offset_path)
+
+    # Claims up to max_lines complete lines appended since the last claim. Returns the
+    # URLs and a ticket to hand to commit() once they have all been processed.
+    def claim(self, max_lines: int) -> tuple:
+        if not os.path.exists(self.path):
+            return [], None
+        with open(self.path, "rb") as f:
+            lock_file(f)
+            try:
+                size = os.fstat(f.fileno()).st_size
+                if size < self.claimed:
+                    logging.warning(f"File '{self.path}' shrank; reading it from the start.")
+                    self.claimed = self.committed = 0
+                    self.pending = []
+                f.seek(self.claimed)
+                data = b""
+                end = 0
+                count = 0
+                # Reads in blocks only as far as max_lines, so a large append is not
+                # re-read in full on every claim
+                while count < max_lines and self.claimed + len(data) < size:
+                    block = f.read(min(FEED_READ_BYTES, size - self.claimed - len(data)))
+                    if not block:
+                        break
+                    data += block
+                    while count < max_lines:
+                        newline = data.find(b"\n", end)
+                        if newline < 0:
+                            break
+                        end = newline + 1
+                        count += 1
+            finally:
+                unlock_file(f)
+        if end == 0:
+            return [], None
+        self.claimed += end
+        ticket = [self.claimed, False]
+        self.pending.append(ticket)
+        lines = data[:end].decode("utf-8", errors="replace").splitlines()
+        return [line.strip() for line in lines if line.strip()], ticket
+
+    # Marks a claim as processed and saves the offset up to which every claim is done
+    def commit(self, ticket: list) -> None:
+        ticket[1] = True
+        while self.pending and self.pending[0][1]:
+            self.committed = self.pending.pop(0)[0]
+        self._save_offset()
+
+    # Empties the file once every line in it has been processed. Checked under the
+    # lock, so lines appended in the meantime are kept for the next claim.
+    def clear_if_consumed(self) -> None:
+        if self.pending or self.committed == 0 or not os.path.exists(self.path):
+            return
+        with open(self.path, "r+b") as f:
+            lock_file(f)
+            try:
+                if os.fstat(f.fileno()).st_size != self.committed:
+                    return
+                f.truncate(0)
+            finally:
+                unlock_file(f)
+        self.committed = self.claimed = 0
+        self._save_offset()
+        logging.info(f"File '{self.path}' cleared after processing.")
+
+# Reads an integer setting from the environment, falling back to default when unset or invalid
+def get_env_int(name: str, default: int) -> int:
+    value = os.getenv(name, "").strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logging.warning(f"Invalid value for '{name}': {value}. Using {default}.")
+        return default
+
+# Reads a float setting from the environment, falling back to default when unset or invalid
+def get_env_float(name: str, default: float) -> float:
+    value = os.getenv(name, "").strip()
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logging.warning(f"Invalid value for '{name}': {value}. Using {default}.")
+        return default
+
+# Reads a boolean setting ("true"/"false", "1"/"0", "yes"/"no", "on"/"off")
+def get_env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name, "").strip().lower()
+    if not value:
+        return default
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    logging.warning(f"Invalid value for '{name}': {value}. Using {default}.")
+    return default
+
+# Reads a setting that must be one of choices (case-insensitive)
+def get_choice(name: str, choices: list, default: str) -> str:
+    value = os.getenv(name, "").strip().lower()
+    if not value:
+        return default
+    if value not in choices:
+        logging.warning(f"Invalid value for '{name}': {value}. Using {default}.")
+        return default
+    return value
+
+# Reads the shard compression setting: "none", "gzip" or "zstd", which falls back to
+# gzip when zstandard is not installed
+def get_shard_compression(name: str) -> str:
+    value = get_choice(name, ["none", "gzip", "zstd"], "gzip")
+    if value == "zstd" and zstandard is None:
+        logging.warning(f"'{name}' is zstd but zstandard is not installed. Using gzip.")
+        return "gzip"
+    return value
+
+# Reads the JSON serializer setting: "json" (standard library) or "orjson", which is
+# only used if the package is installed
+def get_json_serializer(name: str) -> str:
+    value = os.getenv(name, "").strip().lower() or "json"
+    if value not in ("json", "orjson"):
+        logging.warning(f"Invalid value for '{name}': {value}. Using json.")
+        return "json"
+    if value == "orjson" and orjson is None:
+        logging.warning(f"'{name}' is orjson but orjson is not installed. Using json.")
+        return "json"
+    return value
+
+# Reads a list setting such as "[markdown, json]" or "markdown, json"
+def get_env_list(name: str, default: list) -> list:
+    value = os.getenv(name, "").strip()
+    if not value:
+        return default
+    return [item.strip() for item in value.strip("[]").split(",") if item.strip()]
+
+# Reads the output settings: formats from save_in, their file name patterns from
+# save_name (in the same order), page naming from save_options, whether the JSON
+# repeats the Markdown (json_include_markdown) and the JSON serializer
+def get_output_options() -> OutputOptions:
+    formats = []
+    for item in get_env_list("save_in", ["markdown", "json"]):
+        output_format = item.lower()
+        if output_format not in OUTPUT_FORMATS:
+            logging.warning(f"Unknown format in 'save_in': {item}. Ignoring it.")
+        elif output_format not in formats:
+            formats.append(output_format)
+    if not formats:
+        logging.warning("No valid format in 'save_in'. Saving markdown and json.")
+        formats = ["markdown", "json"]
+    file_names = {"markdown": "name", "json": "name"}
+    for output_format, pattern in zip(formats, get_env_list("save_name", [])):
+        file_names[output_format] = pattern
+    naming = os.getenv("save_options", "").strip().lower() or "name.pages"
+    if naming not in ("name.pages", "name.url"):
+        logging.warning(f"Invalid value for 'save_options': {naming}. Using name.pages.")
+        naming = "name.pages"
+    return OutputOptions(
+        formats=formats,
+        file_names=file_names,
+        naming=naming,
+        json_markdown=get_env_bool("json_include_markdown", True),
+        serializer=get_json_serializer("json_serializer")
+    )
+
+# Reads per-domain rate limits written as "[asimov.academy=2, example.com=0.5]"
+def get_rate_limit_overrides(name: str) -> dict:
+    overrides = {}
+    for item in get_env_list(name, []):
+        domain, _, rate = item.partition("=")
+        try:
+            overrides[domain.strip().lower()] = max(0.0, float(rate))
+        except ValueError:
+            logging.warning(f"Invalid rate limit in '{name}': {item}. Ignoring it.")
+    return overrides
+
+# Reads the settings from the environment
+def load_settings() -> Settings:
+    base_dir = os.getenv("dir_save", "scraping_data").strip()
+    if base_dir.startswith("/"):
+        base_dir = base_dir[1:]
+    return Settings(
+        base_dir=base_dir,
+        webhook_url=os.getenv("webhook_notification", "").strip(),
+        mode=os.getenv("mode", "development").strip().lower(),
+        workers=max(1, get_env_int("workers", 1)),
+        workers_per_domain=max(1, get_env_int("workers_per_domain", 2)),
+        fetch_concurrency=max(1, get_env_int("fetch_concurrency", 64)),
+        export_workers=max(1, get_env_int("export_workers", 2)),
+        write_workers=max(1, get_env_int("write_workers", 4)),
+        queue_size=max(1, get_env_int("queue_size", 32)),
+        worker_max_tasks=max(0, get_env_int("worker_max_tasks", 1000)),
+        worker_max_memory_mb=max(0, get_env_int("worker_max_memory_mb", 2048)),
+        journal_file=os.getenv("journal_file", "").strip() or os.path.join(base_dir, "journal.jsonl"),
+        poll_interval=max(0.1, get_env_float("poll_interval", 1.0)),
+        daemon_batch_size=max(1, get_env_int("daemon_batch_size", 1000)),
+        server_host=os.getenv("server_host", "127.0.0.1").strip(),
+        server_port=get_env_int("server_port", 8000),
+        fetch_retries=max(0, get_env_int("fetch_retries", 3)),
+        retry_base_delay=max(0.0, get_env_float("retry_base_delay", 1.0)),
+        breaker_threshold=max(0, get_env_int("breaker_threshold", 5)),
+        breaker_cooldown=max(0.0, get_env_float("breaker_cooldown", 300.0)),
+        rate_limit=max(0.0, get_env_float("rate_limit", 0.0)),
+        rate_limit_burst=max(1.0, get_env_float("rate_limit_burst", 1.0)),
+        rate_limit_overrides=get_rate_limit_overrides("rate_limit_overrides"),
+        state_db=os.getenv("state_db", "").strip() or os.path.join(base_dir, "state.db"),
+        conditional_requests=get_env_bool("conditional_requests", True),
+        cache_dir=os.getenv("cache_dir", "").strip() or os.path.join(base_dir, "cache"),
+        conversion_cache_mb=get_env_int("conversion_cache_mb", 1024),
+        canonicalize_urls=get_env_bool("canonicalize_urls", True),
+        sitemaps=get_env_list("sitemaps", []),
+        crawl_depth=max(0, get_env_int("crawl_depth", 0)),
+        crawl_max_pages=max(0, get_env_int("crawl_max_pages", 1000)),
+        crawl_db=os.getenv("crawl_db", "").strip() or os.path.join(base_dir, "crawl.db"),
+        output=get_output_options(),
+        io_queue_size=max(1, get_env_int("io_queue_size", 256)),
+        fsync_every=max(0, get_env_int("fsync_every", 100)),
+        fsync_interval=max(0.0, get_env_float("fsync_interval", 1.0)),
+        output_db=os.getenv("output_db", "").strip(),
+        output_db_batch=max(1, get_env_int("output_db_batch", 100)),
+        shard_by=get_choice("shard_by", ["none", "domain", "run"], "none"),
+        chunker=get_choice("chunker", ["none", "hierarchical", "hybrid"], "none"),
+        chunk_tokenizer=os.getenv("chunk_tokenizer", "").strip() or "sentence-transformers/all-MiniLM-L6-v2",
+        chunk_max_tokens=max(0, get_env_int("chunk_max_tokens", 0)),
+        chunk_dir=os.getenv("chunk_dir", "").strip() or os.path.join(base_dir, "chunks"),
+        chunk_batch_size=max(1, get_env_int("chunk_batch_size", 256)),
+        embedder=os.getenv("embedder", "").strip(),
+        embedding_batch_size=max(1, get_env_int("embedding_batch_size", 64)),
+        embedding_dim=max(1, get_env_int("embedding_dim", 256)),
+        parquet_dir=os.getenv("parquet_dir", "").strip(),
+        parquet_row_group=max(1, get_env_int("parquet_row_group", 1000)),
+        shard_dir=os.getenv("shard_dir", "").strip() or os.path.join(base_dir, "shards"),
+        shard_max_mb=max(1, get_env_int("shard_max_mb", 256)),
+        shard_compression=get_shard_compression("shard_compression"),
+    )
+
+# Tells whether a URL is an http(s) URL with a usable hostname (not "." or "..",
+# no path separators) and a valid port
+def is_http_url(url: str) -> bool:
+    parsed = urlparse(url)
+    try:
+        parsed.port
+    except ValueError:
+        return False
+    hostname = parsed.hostname or ""
+    return (parsed.scheme in ("http", "https") and hostname.strip(".") != ""
+            and re.fullmatch(r"[a-z0-9.\-_\[\]:]+", hostname) is not None)
+
+# Returns the domain of a URL, or LOCAL_DOMAIN for offline pages without a host
+def get_url_domain(url: str) -> str:
+    parsed = urlparse(url)
+    if parsed.scheme == "file" or not parsed.netloc:
+        return LOCAL_DOMAIN
+    return parsed.netloc
 
 # Groups domains by primary domain; for this project, domains ending with "asimov.academy" are grouped together
 def get_primary_domain(domain: str) -> str:
@@ -105,109 +2333,817 @@ def get_primary_domain(domain: str) -> str:
     return domain
 
 # Sends a webhook notification to the specified URL with the given payload
-def send_webhook_notification(payload: list, webhook_url: str) -> None:
+def send_webhook_notification(payload: list, webhook_url: str) -> bool:
     try:
         response = requests.post(webhook_url, json=payload, timeout=10)
         if response.status_code == 200:
             logging.info("Webhook sent successfully.")
+            return True
         else:
             logging.error(f"Webhook failed with status code: {response.status_code}")
     except Exception as e:
         logging.error(f"Error sending webhook: {e}")
+    return False
+
+# Removes the first `consumed` bytes (the lines read at startup) from the URLs file.
+# Lines appended while the run was in progress are kept for the next run.
+def clear_urls_file(file_path: str, consumed: int) -> None:
+    with open(file_path, "r+b") as f:
+        lock_file(f)
+        try:
+            f.seek(consumed)
+            remaining = f.read()
+            f.seek(0)
+            f.truncate(0)
+            f.write(remaining)
+        finally:
+            unlock_file(f)
+    if remaining.strip():
+        logging.info(f"File '{file_path}' cleared after processing; kept the URLs added during the run.")
+    else:
+        logging.info(f"File '{file_path}' cleared after processing.")
 
-# Clears the URLs file
-def clear_urls_file(file_path: str) -> None:
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.truncate(0)
-    logging.info(f"File '{file_path}' cleared after processing.")
+# Builds the webhook payload: records sorted by URL, grouped by sorted primary domain
+def build_webhook_payload(processed_data: dict) -> list:
+    webhook_payload = []
+    for primary in sorted(processed_data.keys()):
+        sorted_records = sorted(processed_data[primary], key=lambda r: r["url"])
+        webhook_payload.append({
+            "domain": primary,
+            "urls": sorted_records
+        })
+    return webhook_payload
+
+# Returns the canonical form of a URL: lowercase scheme and host without the default
+# port, no fragment, tracking parameters removed, remaining query keys sorted and no
+# trailing slash except on the root path. It is only a key for spotting duplicates;
+# URLs are always downloaded as listed, since servers may treat these forms differently.
+def canonicalize_url(url: str) -> str:
+    parsed = urlparse(url.strip())
+    if not parsed.scheme or not parsed.netloc:
+        return url.strip()
+    try:
+        port = parsed.port
+    except ValueError:
+        # Invalid port; left for the download to report
+        return url.strip()
+    scheme = parsed.scheme.lower()
+    # Only the host is lowercased; user info may hold case-sensitive credentials
+    userinfo, _, _ = parsed.netloc.rpartition("@")
+    hostname = parsed.hostname or ""
+    netloc = f"[{hostname}]" if ":" in hostname else hostname
+    if port is not None and (scheme, port) not in (("http", 80), ("https", 443)):
+        netloc = f"{netloc}:{port}"
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    path = parsed.path or "/"
+    if len(path) > 1:
+        path = path.rstrip("/") or "/"
+    # Parameters are kept as written (valueless keys stay valueless) and only sorted
+    query = []
+    for param in parsed.query.split("&"):
+        key = unquote_plus(param.partition("=")[0])
+        if param and not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS:
+            query.append((key, param))
+    query.sort(key=lambda item: item[0])
+    return urlunparse((scheme, netloc, path, parsed.params, "&".join(param for _, param in query), ""))
+
+# Drops URLs that share a canonical form. Returns the URLs to download (the first
+# spelling listed of each) and, for each of them, the lines of the input it stands for.
+def dedupe_urls(urls: list) -> tuple:
+    groups = {}
+    for url in urls:
+        groups.setdefault(canonicalize_url(url), []).append(url)
+    aliases = {spellings[0]: spellings for spellings in groups.values()}
+    return list(aliases), aliases
+
+# Gives every input URL its own record again after deduplication: each alias gets a
+# copy of the record of the URL that was downloaded for it, with that URL alongside
+def expand_aliases(processed_data: dict, aliases: dict) -> dict:
+    expanded = {}
+    for domain, records in processed_data.items():
+        for record in records:
+            originals = aliases.get(record["url"], [record["url"]])
+            for original in originals:
+                if original == record["url"]:
+                    expanded.setdefault(domain, []).append(record)
+                else:
+                    alias_record = dict(record, url=original, canonical_url=record["url"])
+                    expanded.setdefault(get_primary_domain(get_url_domain(original)), []).append(alias_record)
+    return expanded
+
+# Opens a sitemap (URL or local file) as a byte stream, unpacking it on the fly
+# when it is gzipped
+def open_sitemap(session: requests.Session, source: str):
+    if os.path.exists(source):
+        stream = open(source, "rb")
+    else:
+        response = session.get(source, stream=True, timeout=FETCH_TIMEOUT)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        # Keep the raw stream readable at EOF, as the buffered reader expects
+        response.raw.auto_close = False
+        stream = io.BufferedReader(response.raw, 64 * 1024)
+    if stream.peek(2)[:2] == b"\x1f\x8b":
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+# Parses a sitemap W3C datetime ("2024", "2024-05", "2024-05-01" or
+# "2024-05-01T10:00:00+00:00") as UTC; a year or month stands for its first day
+def parse_lastmod(value: str) -> datetime.datetime | None:
+    value = value.strip()
+    partial = re.fullmatch(r"(\d{4})(?:-(\d{2}))?", value)
+    try:
+        if partial:
+            parsed = datetime.datetime(int(partial.group(1)), int(partial.group(2) or 1), 1)
+        else:
+            parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.astimezone(datetime.timezone.utc)
+
+# Yields the (url, lastmod) entries of a sitemap, following sitemap indexes. The XML
+# is parsed incrementally and every entry is dropped once read, so memory does not
+# grow with the size of the sitemap.
+def iter_sitemap(session: requests.Session, source: str, seen: set, depth: int = 0):
+    if source in seen:
+        return
+    seen.add(source)
+    try:
+        stream = open_sitemap(session, source)
+    except Exception as e:
+        logging.error(f"Error reading sitemap: {source}. Details: {e}")
+        return
+    nested = []
+    try:
+        root = None
+        for event, element in ElementTree.iterparse(stream, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                continue
+            tag = element.tag.rsplit("}", 1)[-1]
+            if tag not in ("url", "sitemap"):
+                continue
+            loc = lastmod = None
+            for child in element:
+                child_tag = child.tag.rsplit("}", 1)[-1]
+                if child_tag == "loc" and child.text:
+                    loc = child.text.strip()
+                elif child_tag == "lastmod" and child.text:
+                    lastmod = parse_lastmod(child.text)
+            root.clear()
+            if not loc:
+                continue
+            if tag == "url":
+                yield loc, lastmod
+            elif depth < MAX_SITEMAP_DEPTH:
+                nested.append(loc)
+    except (ElementTree.ParseError, OSError, EOFError, requests.RequestException, urllib3.exceptions.HTTPError) as e:
+        # A truncated or malformed sitemap, or a download cut off mid-stream, keeps the
+        # entries read so far
+        logging.error(f"Error reading sitemap: {source}. Details: {e}")
+    finally:
+        stream.close()
+    for loc in nested:
+        yield from iter_sitemap(session, loc, seen, depth + 1)
+
+# Reads the URLs of the configured sitemaps, leaving out those whose lastmod is not
+# newer than their last successful run. The URLs are returned as a list so main can
+# dedupe, sort and interleave them with the rest of urls.txt
+def read_sitemaps(settings: Settings) -> list:
+    urls = []
+    skipped = 0
+    state = StateStore(settings.state_db)
+    session = create_session(1)
+    try:
+        for sitemap in settings.sitemaps:
+            for url, lastmod in iter_sitemap(session, sitemap, set()):
+                if lastmod is not None:
+                    last_success = state.get_last_success(url)
+                    if last_success is not None and lastmod <= last_success:
+                        skipped += 1
+                        continue
+                urls.append(url)
+    finally:
+        session.close()
+        state.close()
+    logging.info(f"Read {len(urls) + skipped} URL(s) from {len(settings.sitemaps)} sitemap(s); "
+                 f"{skipped} unchanged since their last successful run.")
+    return urls
+
+# Tells whether a urls.txt line is an offline input (a local HTML file, a directory,
+# a glob or a WARC archive) rather than a URL to download
+def is_offline_input(line: str) -> bool:
+    return not line.lower().startswith(("http://", "https://"))
+
+# Tells whether an HTTP Content-Type is an HTML page
+def is_html_type(content_type: str) -> bool:
+    return content_type.split(";")[0].strip().lower() in ("text/html", "application/xhtml+xml")
+
+# Parses the header lines of a WARC record or HTTP message into a dict with
+# lowercase names
+def parse_headers(lines: list) -> dict:
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(b":")
+        headers[name.strip().decode("latin1").lower()] = value.strip().decode("latin1")
+    return headers
+
+# Decodes a body sent with Transfer-Encoding: chunked
+def decode_chunked(body: bytes) -> bytes:
+    decoded = bytearray()
+    position = 0
+    while position < len(body):
+        line_end = body.find(b"\r\n", position)
+        if line_end < 0:
+            break
+        size = int(body[position:line_end].split(b";")[0] or b"0", 16)
+        if size == 0:
+            break
+        decoded += body[line_end + 2:line_end + 2 + size]
+        position = line_end + 2 + size + 2
+    return bytes(decoded)
+
+# Returns the HTML body of an archived HTTP response, or None for anything other
+# than a successful HTML response
+def read_http_response(block: bytes) -> bytes | None:
+    head, separator, body = block.partition(b"\r\n\r\n")
+    if not separator:
+        return None
+    lines = head.split(b"\r\n")
+    status = lines[0].split(b" ")
+    if len(status) < 2 or not status[1].startswith(b"2"):
+        return None
+    headers = parse_headers(lines[1:])
+    if not is_html_type(headers.get("content-type", "")):
+        return None
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = decode_chunked(body)
+    encoding = headers.get("content-encoding", "").lower()
+    try:
+        if encoding in ("gzip", "x-gzip"):
+            body = gzip.decompress(body)
+        elif encoding == "deflate":
+            body = zlib.decompress(body)
+    except (OSError, zlib.error):
+        # Archivers often store the body already decoded while keeping the header
+        pass
+    return body
+
+# Reads a WARC or WARC.gz archive record by record and yields the (target URI, HTML)
+# of its successful HTML responses and HTML resource records. Gzipped archives hold
+# one gzip member per record, which the gzip reader streams through transparently.
+def iter_warc(path: str):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            if not line.strip():
+                continue
+            if not line.startswith(b"WARC/"):
+                logging.error(f"Error reading WARC archive: {path}. Details: unexpected line {line[:40]!r}")
+                return
+            header_lines = []
+            while True:
+                line = f.readline()
+                if not line or not line.strip():
+                    break
+                header_lines.append(line.rstrip(b"\r\n"))
+            headers = parse_headers(header_lines)
+            block = f.read(int(headers.get("content-length", "0")))
+            record_type = headers.get("warc-type", "")
+            target = headers.get("warc-target-uri", "").strip("<>")
+            if not target:
+                continue
+            if record_type == "response" and headers.get("content-type", "").startswith("application/http"):
+                body = read_http_response(block)
+                if body is not None:
+                    yield target, body
+            elif record_type == "resource" and is_html_type(headers.get("content-type", "")):
+                yield target, block
+
+# Expands offline inputs into the files they name: globs are matched (** included),
+# directories are searched for HTML files and WARC archives
+def find_offline_files(inputs: list) -> list:
+    files = []
+    for item in inputs:
+        path = item[len("file://"):] if item.startswith("file://") else item
+        matches = sorted(glob.glob(path, recursive=True)) if glob.has_magic(path) else [path]
+        if not matches or not os.path.exists(matches[0]):
+            logging.error(f"Offline input not found: {item}")
+            continue
+        for match in matches:
+            if os.path.isdir(match):
+                for root, dirs, names in os.walk(match):
+                    dirs.sort()
+                    files.extend(os.path.join(root, name) for name in sorted(names)
+                                 if name.lower().endswith((".html", ".htm", ".xhtml", ".warc", ".warc.gz")))
+            else:
+                files.append(match)
+    return list(dict.fromkeys(files))
+
+# Yields the (source_url, content) pages of offline inputs: local HTML files, with
+# their file:// URL as source, and the HTML responses archived in WARC files, with
+# their original URL
+def iter_offline_pages(inputs: list):
+    for path in find_offline_files(inputs):
+        lower = path.lower()
+        if lower.endswith((".warc", ".warc.gz")):
+            try:
+                yield from iter_warc(path)
+            except (OSError, EOFError, ValueError) as e:
+                logging.error(f"Error reading WARC archive: {path}. Details: {e}")
+        elif lower.endswith((".html", ".htm", ".xhtml")):
+            try:
+                with open(path, "rb") as f:
+                    content = f.read()
+            except OSError as e:
+                logging.error(f"Error reading file: {path}. Details: {e}")
+                continue
+            yield "file://" + os.path.abspath(path), content
+        else:
+            logging.warning(f"Skipping unsupported offline input: {path}")
+
+# Sorts URLs by primary domain and URL
+def sort_urls(urls: list) -> list:
+    return sorted(urls, key=lambda u: (get_primary_domain(get_url_domain(u)), u))
+
+# Service mode: watches the URLs file and feeds newly appended lines into the warm
+# pipeline as they arrive; offline inputs (local HTML files, directories, globs and
+# WARC archives) are read as in a one-off run. Each claimed group of lines is reported
+# with its own webhook once all of its pages have finished. SIGINT/SIGTERM stop
+# claiming, let the claimed pages finish and then exit.
+async def run_daemon(settings: Settings, urls_file: str) -> None:
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    pool = WorkerPool(settings.workers, settings.worker_max_tasks,
+                      settings.worker_max_memory_mb * 1024 * 1024)
+    pipeline = Pipeline(pool, settings)
+    feed = UrlFeed(urls_file)
+    reports = set()
+
+    async def report(batch: Batch, ticket: list) -> None:
+        processed_data = await batch.wait()
+        if settings.webhook_url:
+            await loop.run_in_executor(None, send_webhook_notification,
+                                       build_webhook_payload(processed_data), settings.webhook_url)
+        feed.commit(ticket)
+
+    logging.info(f"Watching '{urls_file}' for new URLs with {settings.workers} worker(s).")
+    pipeline.start()
+    try:
+        while not stopping.is_set():
+            lines, ticket = feed.claim(settings.daemon_batch_size)
+            if ticket is None:
+                if settings.mode == "production":
+                    feed.clear_if_consumed()
+                try:
+                    await asyncio.wait_for(stopping.wait(), settings.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            logging.info(f"Claimed {len(lines)} new line(s) from '{urls_file}'.")
+            urls = [line for line in lines if not is_offline_input(line)]
+            offline_inputs = [line for line in lines if is_offline_input(line)]
+            batch = Batch(len(urls))
+            for url in interleave_domains(sort_urls(urls)):
+                await pipeline.submit(url, batch)
+            if offline_inputs:
+                await pipeline.submit_pages(iter_offline_pages(offline_inputs), batch)
+            # Reported once every page of the group is submitted, so the group is not
+            # taken as finished before its offline pages are counted
+            task = asyncio.create_task(report(batch, ticket))
+            reports.add(task)
+            task.add_done_callback(reports.discard)
+        logging.info("Stopping; waiting for the claimed URLs to finish.")
+        await pipeline.stop()
+        await asyncio.gather(*reports)
+    finally:
+        pipeline.close()
+        pool.close()
+
+def daemon() -> None:
+    load_dotenv()
+    setup_logging()
+    settings = load_settings()
+    os.makedirs(settings.base_dir, exist_ok=True)
+    asyncio.run(run_daemon(settings, "urls.txt"))
+
+# A conversion job submitted through the HTTP API. Its records are appended from
+# the pipeline's event loop and read by the request handler threads.
+class ApiJob:
+    def __init__(self, job_id: str, total: int):
+        self.job_id = job_id
+        self.total = total
+        self.records = []
+        self.batch = None
+        self.created_at = datetime.datetime.now().isoformat()
+        self.cond = threading.Condition()
+
+    def add_record(self, result_data: dict) -> None:
+        with self.cond:
+            self.records.append(result_data)
+            self.cond.notify_all()
+
+    @property
+    def done(self) -> bool:
+        return len(self.records) >= self.total
+
+    def summary(self) -> dict:
+        with self.cond:
+            records = list(self.records)
+        processed_data = {}
+        for record in records:
+            processed_data.setdefault(get_primary_domain(get_url_domain(record["url"])), []).append(record)
+        return {
+            "job_id": self.job_id,
+            "status": "done" if len(records) >= self.total else "running",
+            "created_at": self.created_at,
+            "total": self.total,
+            "finished": len(records),
+            "results": build_webhook_payload(processed_data)
+        }
+
+# Serves conversion jobs over HTTP, backed by one warm pipeline and worker pool
+# that run on an event loop in a background thread:
+#   POST /jobs                  {"url": ...} or {"urls": [...]} as JSON, or a raw
+#                               HTML body (Content-Type: text/html, optional
+#                               ?url=<source url>); returns {"job_id": ...}
+#   GET  /jobs/<id>             status and result records
+#   GET  /jobs/<id>/events      result records streamed as NDJSON as they finish
+#   GET  /jobs/<id>/result?url=<url>&format=markdown|json
+#                               converted content of one URL of the job
+#   GET  /health
+class JobServer:
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.pool = WorkerPool(settings.workers, settings.worker_max_tasks,
+                               settings.worker_max_memory_mb * 1024 * 1024)
+        self.pipeline = Pipeline(self.pool, settings)
+
+    def start(self) -> None:
+        self.thread.start()
+        self.loop.call_soon_threadsafe(self.pipeline.start)
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.pipeline.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.pipeline.close()
+        self.pool.close()
+
+    # Creates a job for the given pages ((url, content) pairs; content is None for
+    # pages to download) and queues them on the pipeline
+    def submit(self, pages: list) -> ApiJob:
+        job = ApiJob(uuid.uuid4().hex, len(pages))
+        with self.jobs_lock:
+            self.jobs[job.job_id] = job
+            self._evict_jobs()
+
+        async def enqueue() -> None:
+            job.batch = Batch(len(pages))
+            job.batch.on_record = job.add_record
+            for url, content in pages:
+                await self.pipeline.submit(url, job.batch, content)
+
+        asyncio.run_coroutine_threadsafe(enqueue(), self.loop)
+        logging.info(f"Job {job.job_id} queued with {len(pages)} URL(s).")
+        return job
+
+    # Forgets the oldest finished jobs once more than MAX_API_JOBS are kept
+    def _evict_jobs(self) -> None:
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= MAX_API_JOBS:
+                break
+            if self.jobs[job_id].done:
+                del self.jobs[job_id]
+
+    def get_job(self, job_id: str) -> ApiJob | None:
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    server_version = "docling-beta"
+
+    def log_message(self, format: str, *args) -> None:
+        logging.info(f"{self.address_string()} - {format % args}")
+
+    def send_json(self, status: int, data) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int, message: str) -> None:
+        self.send_json(status, {"error": message})
+
+    def do_POST(self) -> None:
+        parsed = urlparse(self.path)
+        if parsed.path.rstrip("/") != "/jobs":
+            self.send_error_json(404, "Not found.")
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_error_json(400, "Invalid Content-Length.")
+            return
+        if length > MAX_UPLOAD_BYTES:
+            self.send_error_json(413, "Request body too large.")
+            return
+        body = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type in ("text/html", "application/xhtml+xml"):
+            source_url = parse_qs(parsed.query).get("url", [f"http://upload/{uuid.uuid4().hex}.html"])[0]
+            if not is_http_url(source_url):
+                self.send_error_json(400, "'url' must be an http(s) URL with a hostname.")
+                return
+            pages = [(source_url, body)]
+        else:
+            try:
+                data = json.loads(body or b"{}")
+            except ValueError:
+                self.send_error_json(400, "Body must be JSON or text/html.")
+                return
+            if not isinstance(data, dict):
+                self.send_error_json(400, "Provide 'url' or a list of 'urls'.")
+                return
+            urls = data.get("urls") or ([data["url"]] if data.get("url") else [])
+            if not isinstance(urls, list) or not all(isinstance(u, str) and u.strip() for u in urls):
+                self.send_error_json(400, "Provide 'url' or a list of 'urls'.")
+                return
+            invalid = [u for u in urls if not is_http_url(u.strip())]
+            if invalid:
+                self.send_error_json(400, f"Not an http(s) URL with a hostname: {invalid[0]}")
+                return
+            pages = [(url, None) for url in interleave_domains(sort_urls([u.strip() for u in urls]))]
+        if not pages:
+            self.send_error_json(400, "Provide 'url' or a list of 'urls'.")
+            return
+        job = self.server.app.submit(pages)
+        self.send_json(202, {"job_id": job.job_id, "total": job.total, "status_url": f"/jobs/{job.job_id}"})
+
+    def do_GET(self) -> None:
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split("/") if part]
+        if parts == ["health"]:
+            self.send_json(200, {"status": "ok"})
+            return
+        if len(parts) < 2 or parts[0] != "jobs":
+            self.send_error_json(404, "Not found.")
+            return
+        job = self.server.app.get_job(parts[1])
+        if job is None:
+            self.send_error_json(404, "Unknown job.")
+            return
+        if len(parts) == 2:
+            self.send_json(200, job.summary())
+        elif parts[2:] == ["events"]:
+            self.stream_events(job)
+        elif parts[2:] == ["result"]:
+            self.send_result(job, parse_qs(parsed.query))
+        else:
+            self.send_error_json(404, "Not found.")
+
+    # Streams the job's records as NDJSON, one line per finished URL, until the job is done
+    def stream_events(self, job: ApiJob) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        sent = 0
+        try:
+            while True:
+                with job.cond:
+                    if sent >= len(job.records) and not job.done:
+                        job.cond.wait(15)
+                    records = job.records[sent:]
+                    done = job.done
+                # An empty line keeps idle connections alive
+                lines = [json.dumps(r, ensure_ascii=False) for r in records] or [""]
+                chunk = ("\n".join(lines) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.flush()
+                sent += len(records)
+                if done and sent >= len(job.records):
+                    break
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_result(self, job: ApiJob, query: dict) -> None:
+        url = query.get("url", [None])[0]
+        output_format = query.get("format", ["markdown"])[0]
+        paths = job.batch.outputs.get(url) if job.batch is not None and url else None
+        if url is None and job.batch is not None and len(job.batch.outputs) == 1:
+            url, paths = next(iter(job.batch.outputs.items()))
+        if paths and "database" in paths:
+            self.send_stored_result(self.server.app.pipeline.database.read(url), output_format)
+            return
+        if paths and "shard" in paths:
+            self.send_shard_result(paths, output_format)
+            return
+        if not paths or output_format not in paths:
+            self.send_error_json(404, "No result for this URL and format.")
+            return
+        try:
+            with open(paths[output_format], "rb") as f:
+                body = f.read()
+        except OSError:
+            self.send_error_json(404, "Result file not found.")
+            return
+        self.send_result_body(body, output_format)
+
+    # Sends the result of a URL saved in a shard, read back through its offset
+    def send_shard_result(self, paths: dict, output_format: str) -> None:
+        try:
+            record = read_shard_record(paths["shard"], paths["offset"], paths["length"])
+        except (OSError, ValueError, RuntimeError) as e:
+            self.send_error_json(404, f"Result not readable: {e}")
+            return
+        self.send_stored_result(record, output_format)
+
+    # Sends the Markdown or JSON of a page record read from a shard or the output database
+    def send_stored_result(self, record: dict | None, output_format: str) -> None:
+        if record is None:
+            self.send_error_json(404, "No result for this URL and format.")
+            return
+        if output_format == "markdown" and "markdown" in record:
+            body = record["markdown"].encode("utf-8")
+        elif output_format == "json" and "content" in record:
+            body = json.dumps(record, indent=2, ensure_ascii=False).encode("utf-8")
+        else:
+            self.send_error_json(404, "No result for this URL and format.")
+            return
+        self.send_result_body(body, output_format)
+
+    def send_result_body(self, body: bytes, output_format: str) -> None:
+        content_type = "application/json" if output_format == "json" else "text/markdown"
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+# Server entry point: keeps the converter pool warm and accepts jobs over HTTP
+def serve() -> None:
+    load_dotenv()
+    setup_logging()
+    settings = load_settings()
+    os.makedirs(settings.base_dir, exist_ok=True)
+    app = JobServer(settings)
+    app.start()
+    httpd = ThreadingHTTPServer((settings.server_host, settings.server_port), JobRequestHandler)
+    httpd.daemon_threads = True
+    httpd.app = app
+    logging.info(f"Serving conversion jobs on http://{settings.server_host}:{settings.server_port} "
+                 f"with {settings.workers} worker(s).")
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=httpd.shutdown).start())
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        app.stop()
 
 def main() -> None:
     load_dotenv()
-    logging.basicConfig(level=logging.INFO, 
-                        format="%(asctime)s - %(levelname)s - %(message)s",
-                        datefmt="%Y-%m-%d %H:%M:%S")
-    
-    base_dir = os.getenv("dir_save", "scraping_data").strip()
-    if base_dir.startswith("/"):
-        base_dir = base_dir[1:]
-    os.makedirs(base_dir, exist_ok=True)
+    setup_logging()
     
-    webhook_url = os.getenv("webhook_notification", "").strip()
-    mode = os.getenv("mode", "development").strip().lower()
+    settings = load_settings()
+    os.makedirs(settings.base_dir, exist_ok=True)
     urls_file = "urls.txt"
     
-    if not os.path.exists(urls_file):
+    if not os.path.exists(urls_file) and not settings.sitemaps:
         logging.error(f"File '{urls_file}' not found. Exiting.")
         return
 
-    with open(urls_file, "r", encoding="utf-8") as f:
-        urls = [line.strip() for line in f if line.strip()]
+    data = b""
+    if os.path.exists(urls_file):
+        with open(urls_file, "rb") as f:
+            data = f.read()
+    lines = [line.strip() for line in data.decode("utf-8").splitlines() if line.strip()]
+    urls = [line for line in lines if not is_offline_input(line)]
+    offline_inputs = [line for line in lines if is_offline_input(line)]
+    if settings.sitemaps:
+        urls.extend(read_sitemaps(settings))
     
-    if not urls:
-        logging.error("No valid URLs found in 'urls.txt'. Exiting.")
+    if not urls and not offline_inputs:
+        logging.error("No valid URLs found in 'urls.txt' or the sitemaps. Exiting.")
         return
     
+    # Convert each page once, however many spellings of its URL are listed
+    aliases = {}
+    if settings.canonicalize_urls:
+        unique_urls, aliases = dedupe_urls(urls)
+        if len(unique_urls) < len(urls):
+            logging.info(f"{len(urls) - len(unique_urls)} duplicate URL(s) will reuse the result of the first spelling listed.")
+        urls = unique_urls
+    
     # Sort URLs by primary domain and URL
-    urls = sorted(urls, key=lambda u: (get_primary_domain(urlparse(u).netloc), u))
+    urls = sort_urls(urls)
+    
+    # Resume an interrupted run: URLs already in the journal are not processed again
+    journal = Journal(settings.journal_file)
+    offline = bool(offline_inputs) and settings.crawl_depth == 0
+    completed = journal.load(urls if settings.crawl_depth == 0 and not offline else None)
+    journaled = {}
+    if offline:
+        # Offline pages are only known once read, so their entries are picked out of
+        # the journal as the pages come up; entries for anything else are left out
+        journaled = {record["url"]: (domain, record) for domain, record in completed}
+        completed = [journaled[url] for url in urls if url in journaled]
+    done = {record["url"] for _, record in completed}
+    if completed:
+        urls = [url for url in urls if url not in done]
+        logging.info(f"Resuming previous run: {len(done)} URL(s) already completed in '{journal.path}'.")
+    pages = None
+    restored = []
+    if offline_inputs and settings.crawl_depth > 0:
+        logging.warning("Offline inputs are ignored in crawl mode.")
+    elif offline_inputs:
+        def read_offline_pages():
+            for page in iter_offline_pages(offline_inputs):
+                if page[0] in journaled:
+                    restored.append(journaled[page[0]])
+                else:
+                    yield page
+        pages = read_offline_pages()
     
     total_urls = len(urls)
-    logging.info(f"Starting processing of {total_urls} URL(s).")
+    logging.info(f"Starting processing of {total_urls} URL(s){' and the offline inputs' if offline_inputs else ''} "
+                 f"with {settings.workers} worker(s), at most {settings.workers_per_domain} request(s) per domain.")
     
-    processed_data = {}
-    for idx, url in enumerate(urls, start=1):
-        logging.info(f"Processing URL {idx} of {total_urls}")
-        with ProcessPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(process_url, url, base_dir)
-            try:
-                domain, result_data = future.result(timeout=60)
-            except TimeoutError:
-                logging.error(f"Timeout after 1 minute for URL: {url}")
-                domain = urlparse(url).netloc
-                result_data = {
-                    "url": url,
-                    "status": "error",
-                    "processing_time": None,
-                    "processing_time_formatted": "Timeout after 1 minute",
-                    "error_message": "Timeout after 1 minute"
-                }
-            except Exception as e:
-                logging.error(f"Error processing URL: {url}. Details: {e}")
-                domain = urlparse(url).netloc
-                result_data = {
-                    "url": url,
-                    "status": "error",
-                    "processing_time": None,
-                    "processing_time_formatted": "Error occurred",
-                    "error_message": str(e)
-                }
-        primary = get_primary_domain(domain)
-        if primary in processed_data:
-            processed_data[primary].append(result_data)
+    # Long-lived workers are reused for every URL, so docling is imported and the
+    # converter is built only once per worker
+    pool = WorkerPool(settings.workers, settings.worker_max_tasks,
+                      settings.worker_max_memory_mb * 1024 * 1024)
+    pipeline = Pipeline(pool, settings)
+    try:
+        if settings.crawl_depth > 0:
+            batch = Batch(0, journal)
+            batch.restore(completed)
+            processed_data = asyncio.run(run_crawl(pipeline, urls, batch, settings))
         else:
-            processed_data[primary] = [result_data]
+            batch = Batch(len(urls), journal)
+            batch.restore(completed)
+            processed_data = asyncio.run(pipeline.run(urls, batch, pages))
+            if restored:
+                logging.info(f"Resumed {len(restored)} offline page(s) already completed in '{journal.path}'.")
+                batch.restore(restored)
+    finally:
+        pipeline.close()
+        pool.close()
+        journal.close()
 
     logging.info("Processing completed for all URLs.")
     
     # Build sorted webhook payload based on primary domain
-    webhook_payload = []
-    for primary in sorted(processed_data.keys()):
-        sorted_records = sorted(processed_data[primary], key=lambda r: r["url"])
-        webhook_payload.append({
-            "domain": primary,
-            "urls": sorted_records
-        })
+    webhook_payload = build_webhook_payload(expand_aliases(processed_data, aliases))
     
-    if webhook_url:
+    if settings.webhook_url:
         logging.info("Sending webhook notification...")
-        send_webhook_notification(webhook_payload, webhook_url)
+        reported = send_webhook_notification(webhook_payload, settings.webhook_url)
     else:
         logging.info("Webhook not configured; notification not sent.")
+        reported = True
+    
+    # Keep the journal if the webhook failed, so the next run only resends it
+    if reported:
+        journal.remove()
     
     # Clear urls.txt only in production mode
-    if mode == "production":
-        clear_urls_file(urls_file)
+    if settings.mode == "production":
+        if data:
+            clear_urls_file(urls_file, len(data))
     else:
         logging.info("Development mode; urls.txt not cleared.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Converts web pages listed in urls.txt with Docling.")
+    parser.add_argument("command", nargs="?", default="run", choices=["run", "daemon", "serve"],
+                        help="'run' processes urls.txt once (default); 'daemon' keeps watching it "
+                             "for new URLs; 'serve' accepts conversion jobs over HTTP")
+    args = parser.parse_args()
+    if args.command == "daemon":
+        daemon()
+    elif args.command == "serve":
+        serve()
+    else:
+        main()
\ No newline at end of file
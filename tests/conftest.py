@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# html_converter.py is a script at the repository root, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+@pytest.fixture
+def fixtures_dir() -> str:
+    return FIXTURES_DIR
+
+
+@pytest.fixture
+def exported() -> dict:
+    return {
+        "title": "Getting_Started",
+        "markdown": "# Getting Started\n\nInstall the package.\n",
+        "content": {"name": "getting-started", "texts": [{"text": "Install the package."}]}
+    }
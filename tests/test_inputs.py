@@ -0,0 +1,144 @@
+import asyncio
+import gzip
+import os
+import shutil
+
+import html_converter
+
+
+def warc_record(record_type: str, target: str, content_type: str, block: bytes) -> bytes:
+    return (b"WARC/1.0\r\n"
+            + f"WARC-Type: {record_type}\r\nWARC-Target-URI: {target}\r\n"
+              f"Content-Type: {content_type}\r\nContent-Length: {len(block)}\r\n\r\n".encode()
+            + block + b"\r\n\r\n")
+
+
+def http_response(status: str, content_type: str, body: bytes, headers: str = "") -> bytes:
+    return f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n{headers}\r\n".encode() + body
+
+
+def write_warc(path: str, compressed: bool) -> None:
+    chunked = b"6\r\n<p>chu\r\n7\r\nnked</p\r\n1\r\n>\r\n0\r\n\r\n"
+    records = [
+        warc_record("warcinfo", "", "application/warc-fields", b"software: test\r\n"),
+        warc_record("response", "https://example.com/a", "application/http; msgtype=response",
+                    http_response("200 OK", "text/html; charset=utf-8", b"<h1>A</h1>")),
+        warc_record("response", "https://example.com/missing", "application/http; msgtype=response",
+                    http_response("404 Not Found", "text/html", b"<h1>Missing</h1>")),
+        warc_record("response", "https://example.com/style.css", "application/http; msgtype=response",
+                    http_response("200 OK", "text/css", b"body {}")),
+        warc_record("response", "https://example.com/chunked", "application/http; msgtype=response",
+                    http_response("200 OK", "text/html", chunked, "Transfer-Encoding: chunked\r\n")),
+        warc_record("resource", "https://example.com/b", "text/html", b"<h1>B</h1>"),
+    ]
+    with open(path, "wb") as f:
+        for record in records:
+            # Gzipped archives hold one gzip member per record
+            f.write(gzip.compress(record) if compressed else record)
+
+
+def test_iter_warc_yields_successful_html_responses(tmp_path):
+    expected = [("https://example.com/a", b"<h1>A</h1>"),
+                ("https://example.com/chunked", b"<p>chunked</p>"),
+                ("https://example.com/b", b"<h1>B</h1>")]
+    for name, compressed in (("pages.warc", False), ("pages.warc.gz", True)):
+        write_warc(str(tmp_path / name), compressed)
+        assert list(html_converter.iter_warc(str(tmp_path / name))) == expected
+
+
+def test_iter_offline_pages_reads_directories_and_globs(tmp_path, fixtures_dir):
+    site = tmp_path / "site"
+    shutil.copytree(fixtures_dir, site / "docs")
+    write_warc(str(site / "archive.warc.gz"), True)
+    (site / "notes.txt").write_text("not html")
+    pages = list(html_converter.iter_offline_pages([str(site)]))
+    urls = [url for url, _ in pages]
+    assert urls[:3] == ["https://example.com/a", "https://example.com/chunked", "https://example.com/b"]
+    assert urls[3:] == ["file://" + str(site / "docs" / "getting-started.html"),
+                        "file://" + str(site / "docs" / "reference.html")]
+    globbed = list(html_converter.iter_offline_pages([str(site / "**" / "ref*.html"), str(site / "nothing.html")]))
+    assert [url for url, _ in globbed] == ["file://" + str(site / "docs" / "reference.html")]
+    with open(site / "docs" / "reference.html", "rb") as f:
+        assert globbed[0][1] == f.read()
+
+
+def test_is_offline_input():
+    assert html_converter.is_offline_input("pages/*.html")
+    assert html_converter.is_offline_input("/data/crawl.warc.gz")
+    assert not html_converter.is_offline_input("HTTPS://example.com/")
+
+
+def test_url_feed_claims_complete_lines_and_resumes_from_the_offset(tmp_path, monkeypatch):
+    monkeypatch.setattr(html_converter, "FEED_READ_BYTES", 8)
+    path = tmp_path / "urls.txt"
+    path.write_text("https://a.com/1\nhttps://a.com/2\n\nhttps://a.com/3\nhttps://a.com/4")
+    feed = html_converter.UrlFeed(str(path))
+    urls, first = feed.claim(2)
+    assert urls == ["https://a.com/1", "https://a.com/2"]
+    urls, second = feed.claim(10)
+    # The last line is not complete yet, so it is left for a later claim
+    assert urls == ["https://a.com/3"]
+    assert feed.claim(10) == ([], None)
+    # Only claims whose predecessors are all done move the saved offset
+    feed.commit(second)
+    assert html_converter.UrlFeed(str(path)).committed == 0
+    feed.commit(first)
+    restarted = html_converter.UrlFeed(str(path))
+    assert restarted.committed == len("https://a.com/1\nhttps://a.com/2\n\nhttps://a.com/3\n")
+    with open(path, "a") as f:
+        f.write("\n")
+    assert restarted.claim(10)[0] == ["https://a.com/4"]
+
+
+def test_url_feed_clears_the_file_once_consumed(tmp_path):
+    path = tmp_path / "urls.txt"
+    path.write_text("https://a.com/1\n")
+    feed = html_converter.UrlFeed(str(path))
+    urls, ticket = feed.claim(10)
+    feed.clear_if_consumed()
+    assert path.read_text() == "https://a.com/1\n"
+    feed.commit(ticket)
+    feed.clear_if_consumed()
+    assert path.read_text() == ""
+    assert feed.claimed == feed.committed == 0
+
+
+def test_clear_urls_file_keeps_lines_added_during_the_run(tmp_path):
+    path = tmp_path / "urls.txt"
+    path.write_text("https://a.com/1\nhttps://a.com/2\n")
+    consumed = os.path.getsize(path)
+    with open(path, "a") as f:
+        f.write("https://a.com/3\n")
+    html_converter.clear_urls_file(str(path), consumed)
+    assert path.read_text() == "https://a.com/3\n"
+
+
+def test_journal_restores_finished_urls_but_not_short_circuited_ones(tmp_path):
+    async def record_run() -> None:
+        journal = html_converter.Journal(str(tmp_path / "journal.jsonl"))
+        batch = html_converter.Batch(3, journal)
+        batch.add_record("a.com", {"url": "https://a.com/1", "status": "success"})
+        batch.add_record("a.com", {"url": "https://a.com/2", "status": "short_circuited"})
+        batch.add_record("b.com", {"url": "https://b.com/1", "status": "error"})
+        assert batch.done.is_set()
+        journal.close()
+
+    asyncio.run(record_run())
+    with open(tmp_path / "journal.jsonl", "a") as f:
+        f.write('{"domain": "a.com", "record": {"url": "https://a.com/3"')
+    journal = html_converter.Journal(str(tmp_path / "journal.jsonl"))
+    assert journal.load(None) == [("a.com", {"url": "https://a.com/1", "status": "success"}),
+                                  ("b.com", {"url": "https://b.com/1", "status": "error"})]
+    assert journal.load(["https://b.com/1"]) == [("b.com", {"url": "https://b.com/1", "status": "error"})]
+
+    async def resume() -> dict:
+        batch = html_converter.Batch(1, journal)
+        batch.restore(journal.load(None))
+        assert not batch.done.is_set()
+        batch.add_record("a.com", {"url": "https://a.com/2", "status": "success"})
+        return await batch.wait()
+
+    processed = asyncio.run(resume())
+    assert [record["url"] for record in processed["a.com"]] == ["https://a.com/1", "https://a.com/2"]
+    journal.remove()
+    assert not os.path.exists(tmp_path / "journal.jsonl")
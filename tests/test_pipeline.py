@@ -0,0 +1,93 @@
+import asyncio
+import json
+import os
+import signal
+
+import numpy
+import pytest
+
+import html_converter
+
+
+@pytest.fixture
+def run_dir(tmp_path, monkeypatch, fixtures_dir):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(html_converter, "load_dotenv", lambda *args, **kwargs: None)
+    monkeypatch.setenv("HF_HUB_OFFLINE", "1")
+    settings = {"dir_save": "out", "workers": "1", "mode": "development", "chunker": "hierarchical",
+                "embedder": "hash", "embedding_dim": "8", "webhook_notification": "http://webhook.test/"}
+    for name, value in settings.items():
+        monkeypatch.setenv(name, value)
+    (tmp_path / "urls.txt").write_text(fixtures_dir + "\n")
+    payloads = []
+    monkeypatch.setattr(html_converter, "send_webhook_notification",
+                        lambda payload, webhook_url: payloads.append(payload) or True)
+    return tmp_path, payloads
+
+
+def test_offline_run_converts_chunks_and_resumes(run_dir, fixtures_dir):
+    tmp_path, payloads = run_dir
+    getting_started = "file://" + os.path.join(fixtures_dir, "getting-started.html")
+    reference = "file://" + os.path.join(fixtures_dir, "reference.html")
+
+    html_converter.main()
+
+    local_dir = tmp_path / "out" / html_converter.LOCAL_DOMAIN
+    assert sorted(os.listdir(local_dir)) == [
+        "Getting_Started.json", "Getting_Started.md", "Reference.json", "Reference.md"]
+    assert (local_dir / "Reference.md").read_text(encoding="utf-8").startswith("# Reference")
+    saved = json.loads((local_dir / "Getting_Started.json").read_text(encoding="utf-8"))
+    assert saved["source_url"] == getting_started
+    assert saved["content"]["texts"]
+    [payload] = payloads
+    assert payload[0]["domain"] == html_converter.LOCAL_DOMAIN
+    assert [(record["url"], record["status"]) for record in payload[0]["urls"]] == [
+        (getting_started, "success"), (reference, "success")]
+    # The journal is removed once the run has been reported
+    assert not (tmp_path / "out" / "journal.jsonl").exists()
+
+    [chunks_path] = [path for path in (tmp_path / "out" / "chunks").iterdir() if path.suffix == ".jsonl"]
+    with open(chunks_path, encoding="utf-8") as f:
+        chunks = [json.loads(line) for line in f]
+    assert {chunk["source_url"] for chunk in chunks} == {getting_started, reference}
+    vectors = numpy.load(chunks_path.with_suffix(".npy"))
+    assert vectors.shape == (len(chunks), 8)
+    assert [chunk["vector_row"] for chunk in chunks] == list(range(len(chunks)))
+
+    # An interrupted run left a journal: its finished pages are reported, not converted again
+    os.remove(local_dir / "Reference.md")
+    journaled = {"url": reference, "status": "success", "processing_time": 1.0}
+    with open(tmp_path / "out" / "journal.jsonl", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"domain": html_converter.LOCAL_DOMAIN, "record": journaled}) + "\n")
+        f.write(json.dumps({"domain": "stale.example", "record": {"url": "https://stale.example/",
+                                                                   "status": "success"}}) + "\n")
+
+    html_converter.main()
+
+    assert not (local_dir / "Reference.md").exists()
+    resumed = payloads[1]
+    assert [entry["domain"] for entry in resumed] == [html_converter.LOCAL_DOMAIN]
+    records = {record["url"]: record for record in resumed[0]["urls"]}
+    assert records[reference] == journaled
+    assert records[getting_started]["status"] == "success"
+
+
+def test_daemon_converts_offline_inputs_appended_to_the_urls_file(run_dir, fixtures_dir, monkeypatch):
+    tmp_path, payloads = run_dir
+    reference = "file://" + os.path.join(fixtures_dir, "reference.html")
+    (tmp_path / "urls.txt").write_text(os.path.join(fixtures_dir, "ref*.html") + "\n")
+    monkeypatch.setenv("chunker", "none")
+    monkeypatch.setenv("poll_interval", "0.1")
+
+    # The daemon stops on SIGTERM once the claimed group has been reported
+    def report(payload, webhook_url):
+        payloads.append(payload)
+        os.kill(os.getpid(), signal.SIGTERM)
+        return True
+
+    monkeypatch.setattr(html_converter, "send_webhook_notification", report)
+    asyncio.run(html_converter.run_daemon(html_converter.load_settings(), "urls.txt"))
+
+    [payload] = payloads
+    assert [(record["url"], record["status"]) for record in payload[0]["urls"]] == [(reference, "success")]
+    assert (tmp_path / "out" / html_converter.LOCAL_DOMAIN / "Reference.md").exists()
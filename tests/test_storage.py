@@ -0,0 +1,177 @@
+import json
+import os
+import sqlite3
+
+import numpy
+import pytest
+
+import html_converter
+
+
+def test_write_file_atomic_leaves_no_temporary_file(tmp_path):
+    path = tmp_path / "page.json"
+    html_converter.write_file_atomic(str(path), html_converter.dump_json, {"title": "Café"})
+    assert json.loads(path.read_text(encoding="utf-8")) == {"title": "Café"}
+    assert os.listdir(tmp_path) == ["page.json"]
+
+
+def test_file_writer_resolves_futures_once_files_are_committed(tmp_path):
+    writer = html_converter.FileWriter(queue_size=4, fsync_every=2, fsync_interval=5.0)
+    try:
+        first = writer.write(str(tmp_path / "a.md"), html_converter.dump_text, "# A")
+        assert not first.done()
+        assert not (tmp_path / "a.md").exists()
+        second = writer.write(str(tmp_path / "b.json"), html_converter.dump_json, {"b": 1})
+        assert first.result(timeout=5) is None
+        assert second.result(timeout=5) is None
+        assert (tmp_path / "a.md").read_text(encoding="utf-8") == "# A"
+        assert json.loads((tmp_path / "b.json").read_text(encoding="utf-8")) == {"b": 1}
+    finally:
+        writer.close()
+    assert sorted(os.listdir(tmp_path)) == ["a.md", "b.json"]
+
+
+def test_file_writer_commits_a_partial_group_after_the_interval(tmp_path):
+    writer = html_converter.FileWriter(queue_size=4, fsync_every=100, fsync_interval=0.2)
+    try:
+        future = writer.write(str(tmp_path / "a.md"), html_converter.dump_text, "# A")
+        assert future.result(timeout=5) is None
+    finally:
+        writer.close()
+
+
+def test_file_writer_fails_the_future_of_an_unwritable_file(tmp_path):
+    (tmp_path / "taken.md").mkdir()
+    writer = html_converter.FileWriter(queue_size=4, fsync_every=0, fsync_interval=0.0)
+    try:
+        failed = writer.write(str(tmp_path / "taken.md"), html_converter.dump_text, "# A")
+        unencodable = writer.write(str(tmp_path / "bad.json"), html_converter.dump_json, {"x": object()})
+        written = writer.write(str(tmp_path / "ok.md"), html_converter.dump_text, "# OK")
+        assert isinstance(failed.exception(timeout=5), OSError)
+        assert isinstance(unencodable.exception(timeout=5), TypeError)
+        assert written.result(timeout=5) is None
+    finally:
+        writer.close()
+    assert sorted(os.listdir(tmp_path)) == ["ok.md", "taken.md"]
+
+
+def test_save_files_names_files_after_the_title(tmp_path, exported):
+    files, committed = html_converter.save_files(exported, str(tmp_path), "https://example.com/docs/start")
+    assert committed == []
+    assert files == {
+        "markdown": str(tmp_path / "example.com" / "Getting_Started.md"),
+        "json": str(tmp_path / "example.com" / "Getting_Started.json")}
+    saved = json.loads((tmp_path / "example.com" / "Getting_Started.json").read_text(encoding="utf-8"))
+    assert saved["source_url"] == "https://example.com/docs/start"
+    assert saved["content"] == exported["content"]
+    assert saved["markdown"] == exported["markdown"]
+
+
+def test_save_files_honors_output_options(tmp_path, exported):
+    output = html_converter.OutputOptions(formats=["markdown"], file_names={"markdown": "page-name", "json": "name"},
+                                          naming="name.url")
+    files, _ = html_converter.save_files(exported, str(tmp_path), "https://example.com/docs/start.html", output)
+    assert files == {"markdown": str(tmp_path / "example.com" / "page-start.md")}
+
+
+def test_save_files_refuses_directories_outside_base_dir(tmp_path, exported):
+    base_dir = tmp_path / "out"
+    for url in ("http://../x", "http://./x"):
+        with pytest.raises(ValueError):
+            html_converter.save_files(exported, str(base_dir), url)
+    assert not (tmp_path / "Getting_Started.md").exists()
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_shard_writer_records_are_readable_right_away(tmp_path, exported, compression):
+    shards = html_converter.ShardWriter(str(tmp_path), "domain", 400, compression, html_converter.OutputOptions())
+    try:
+        positions = [shards.write(exported, f"https://example.com/{i}") for i in range(3)]
+        for i, position in enumerate(positions):
+            record = html_converter.read_shard_record(position["shard"], position["offset"], position["length"])
+            assert record["source_url"] == f"https://example.com/{i}"
+            assert record["content"] == exported["content"]
+    finally:
+        shards.close()
+    # Rotated at max_bytes, with an index line per record
+    assert len({position["shard"] for position in positions}) > 1
+    index_lines = sum(len(open(f"{path}.idx").readlines()) for path in {p["shard"] for p in positions})
+    assert index_lines == 3
+
+
+def test_output_database_commits_batches_and_partial_batches(tmp_path, exported):
+    database = html_converter.OutputDatabase(str(tmp_path / "pages.db"), batch_size=2, flush_interval=0.2)
+    try:
+        files, first = database.write(exported, "https://example.com/1", "hash", 1.0)
+        assert files == {"database": str(tmp_path / "pages.db")}
+        _, second = database.write(exported, "https://example.com/2", None, 1.0)
+        assert first.done() and second.done()
+        _, third = database.write(exported, "https://example.com/3", None, 1.0)
+        assert third.result(timeout=5) is None
+        stored = database.read("https://example.com/3")
+        assert stored["markdown"] == exported["markdown"]
+        assert stored["content"] == exported["content"]
+    finally:
+        database.close()
+    conn = sqlite3.connect(tmp_path / "pages.db")
+    matches = conn.execute("SELECT count(*) FROM pages_fts WHERE pages_fts MATCH 'install'").fetchone()[0]
+    conn.close()
+    assert matches == 3
+
+
+def test_chunk_writer_stores_hash_embeddings_in_order(tmp_path):
+    embedder = html_converter.load_embedder("hash", 16)
+    writer = html_converter.ChunkWriter(str(tmp_path), batch_size=3, embedder=embedder, embedding_batch_size=2,
+                                        flush_interval=0.2)
+    try:
+        first = writer.add("https://example.com/a", [{"text": "install the package"}, {"text": "run it"}])
+        assert not first.done()
+        second = writer.add("https://example.com/b", [{"text": "settings reference"}, {"text": "defaults"}])
+        assert first.done() and second.done()
+        third = writer.add("https://example.com/c", [{"text": "the last chunk"}])
+        assert third.result(timeout=5) is None
+    finally:
+        writer.close()
+    with open(writer.path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [record["vector_row"] for record in records] == list(range(5))
+    assert [record["chunk_index"] for record in records] == [0, 1, 0, 1, 0]
+    vectors = numpy.load(writer.vectors_path, mmap_mode="r")
+    assert vectors.shape == (5, 16)
+    expected = html_converter.hash_embedding([record["text"] for record in records], 16)
+    assert numpy.allclose(vectors, expected)
+
+
+def test_hash_embedding_is_deterministic_and_normalized():
+    vectors = html_converter.hash_embedding(["Docling converts HTML", "docling converts html", ""], 32)
+    assert numpy.allclose(vectors[0], vectors[1])
+    assert numpy.isclose(numpy.linalg.norm(vectors[0]), 1.0)
+    assert not vectors[2].any()
+
+
+def test_conversion_cache_evicts_least_recently_used(tmp_path, exported):
+    entry_size = len(json.dumps(exported, ensure_ascii=False).encode("utf-8"))
+    cache = html_converter.ConversionCache(str(tmp_path), entry_size * 2, ["markdown", "json"])
+    keys = [cache.key(f"<p>{i}</p>".encode(), "page.html") for i in range(3)]
+    cache.put(keys[0], exported)
+    cache.put(keys[1], exported)
+    assert cache.get(keys[0]) == exported
+    cache.put(keys[2], exported)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == exported
+    assert cache.get(keys[2]) == exported
+
+
+def test_state_store_keeps_validators_and_last_success(tmp_path):
+    state = html_converter.StateStore(str(tmp_path / "state.db"))
+    state.save_validators("https://example.com/", '"abc"', None, {"markdown": "a.md"})
+    state.record_success("https://example.com/")
+    state.close()
+    state = html_converter.StateStore(str(tmp_path / "state.db"))
+    try:
+        assert state.get_validators("https://example.com/") == {
+            "etag": '"abc"', "last_modified": None, "files": {"markdown": "a.md"}}
+        assert state.get_last_success("https://example.com/") is not None
+        assert state.get_last_success("https://example.com/other") is None
+    finally:
+        state.close()
@@ -0,0 +1,45 @@
+import os
+import time
+
+import pytest
+
+import html_converter
+
+
+# Workers take a few seconds to start (each builds a converter), so one pool is shared
+@pytest.fixture(scope="module")
+def pool():
+    pool = html_converter.WorkerPool(1)
+    yield pool
+    pool.close()
+
+
+def test_worker_pool_reuses_a_warm_worker(pool):
+    assert pool.run(sum, ([1, 2, 3],), 30) == 6
+    assert pool.run(os.getpid, (), 30) == pool.run(os.getpid, (), 30)
+
+
+def test_worker_pool_replaces_a_worker_that_times_out(pool):
+    pid = pool.run(os.getpid, (), 30)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        pool.run(time.sleep, (30,), 1)
+    assert time.monotonic() - started < 10
+    assert pool.run(os.getpid, (), 30) != pid
+
+
+def test_worker_pool_reports_failures_and_keeps_the_worker(pool):
+    pid = pool.run(os.getpid, (), 30)
+    with pytest.raises(RuntimeError, match="invalid literal"):
+        pool.run(int, ("not a number",), 30)
+    assert pool.run(os.getpid, (), 30) == pid
+
+
+def test_worker_pool_recycles_workers_after_max_tasks():
+    pool = html_converter.WorkerPool(1, max_tasks=3)
+    try:
+        pids = [pool.run(os.getpid, (), 30) for _ in range(4)]
+    finally:
+        pool.close()
+    assert pids[0] == pids[1] == pids[2]
+    assert pids[3] != pids[0]